@@ -1,13 +1,35 @@
-from flask import Flask, render_template, request, jsonify, session, redirect, url_for, send_from_directory, flash
+from flask import Flask, Request, Response, render_template, request, jsonify, session, redirect, url_for, send_from_directory, flash, stream_with_context
+from flask.sessions import SessionInterface, SessionMixin
+from werkzeug.datastructures import CallbackDict
 from flask_pymongo import PyMongo
+from pymongo import ASCENDING, DESCENDING, ReturnDocument, ReadPreference, InsertOne, UpdateOne, DeleteOne, ReplaceOne, monitoring
+from pymongo.errors import DuplicateKeyError, BulkWriteError, OperationFailure
 from werkzeug.security import generate_password_hash, check_password_hash
-from werkzeug.utils import secure_filename
-from datetime import datetime, timedelta
+from itsdangerous import URLSafeTimedSerializer, BadSignature
+from datetime import datetime, timedelta, timezone
 import os
+import copy
+import secrets
 from bson.objectid import ObjectId
 import json
 from dotenv import load_dotenv
-import uuid
+import click
+import hashlib
+import tempfile
+import gzip
+import shutil
+import re
+import mimetypes
+import struct
+import subprocess
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, TimeoutError as FutureTimeout
+import threading
+import time
+import math
+import atexit
+from collections import OrderedDict
+from bisect import bisect_left, bisect_right
 
 # Load environment variables from .env file
 load_dotenv()
@@ -35,9 +57,44 @@ APP_CONFIG = {
     'GRACE_PERIOD': int(os.environ.get('GRACE_PERIOD', 10)),
     'ADMIN_USERNAME': os.environ.get('ADMIN_USERNAME', 'admin'),
     'ADMIN_PASSWORD': os.environ.get('ADMIN_PASSWORD', 'garage123'),
+    'TEMPLATE_CACHE_TTL': int(os.environ.get('TEMPLATE_CACHE_TTL', 30)),
+    'LIVE_FLUSH_INTERVAL': int(os.environ.get('LIVE_FLUSH_INTERVAL', 5)),
+    'LIVE_MAX_PENDING': int(os.environ.get('LIVE_MAX_PENDING', 10000)),
+    'LIVE_SESSION_EXPIRY': int(os.environ.get('LIVE_SESSION_EXPIRY', 180)),
+    'STATS_RECONCILE_INTERVAL': int(os.environ.get('STATS_RECONCILE_INTERVAL', 3600)),
+    'STATS_FLUSH_INTERVAL': int(os.environ.get('STATS_FLUSH_INTERVAL', 5)),
+    'ROLLUP_FLUSH_INTERVAL': int(os.environ.get('ROLLUP_FLUSH_INTERVAL', 5)),
+    'ROLLUP_MAX_PENDING': int(os.environ.get('ROLLUP_MAX_PENDING', 10000)),
+    'MAX_UPLOAD_MB_2D': int(os.environ.get('MAX_UPLOAD_MB_2D', 16)),
+    'MAX_UPLOAD_MB_3D': int(os.environ.get('MAX_UPLOAD_MB_3D', 200)),
+    'DERIVATIVE_WORKERS': int(os.environ.get('DERIVATIVE_WORKERS', 2)),
+    'GLTFPACK_PATH': os.environ.get('GLTFPACK_PATH', 'gltfpack'),
+    # MongoDB connection pool (per worker process)
+    'WORKER_THREADS': int(os.environ.get('WORKER_THREADS', 8)),
+    'MONGO_MAX_POOL_SIZE': int(os.environ.get('MONGO_MAX_POOL_SIZE', 0)),
+    'MONGO_MIN_POOL_SIZE': int(os.environ.get('MONGO_MIN_POOL_SIZE', 0)),
+    'MONGO_CONNECT_TIMEOUT_MS': int(os.environ.get('MONGO_CONNECT_TIMEOUT_MS', 5000)),
+    'MONGO_SERVER_SELECTION_TIMEOUT_MS': int(os.environ.get('MONGO_SERVER_SELECTION_TIMEOUT_MS', 5000)),
+    'MONGO_SOCKET_TIMEOUT_MS': int(os.environ.get('MONGO_SOCKET_TIMEOUT_MS', 0)),
+    'MONGO_WAIT_QUEUE_TIMEOUT_MS': int(os.environ.get('MONGO_WAIT_QUEUE_TIMEOUT_MS', 0)),
+    'MONGO_READ_PREFERENCE': os.environ.get('MONGO_READ_PREFERENCE', 'primary'),
+    'METRICS_TOKEN': os.environ.get('METRICS_TOKEN', ''),
+    'SLOW_REQUEST_MS': int(os.environ.get('SLOW_REQUEST_MS', 0)),
+    # Password hashing (per worker process)
+    'PASSWORD_HASH_METHOD': os.environ.get('PASSWORD_HASH_METHOD', 'pbkdf2:sha256:600000'),
+    'HASH_WORKERS': int(os.environ.get('HASH_WORKERS', 2)),
+    'HASH_QUEUE_DEPTH': int(os.environ.get('HASH_QUEUE_DEPTH', 8)),
+    'HASH_TIMEOUT': int(os.environ.get('HASH_TIMEOUT', 5)),
+    'FAILED_LOGIN_TTL': int(os.environ.get('FAILED_LOGIN_TTL', 60)),
+    'MAX_FAILED_LOGINS': int(os.environ.get('MAX_FAILED_LOGINS', 5)),
+    # Server-side sessions
+    'SESSION_TIMEOUT': int(os.environ.get('SESSION_TIMEOUT', 7 * 24 * 60 * 60)),
+    'SESSION_CACHE_SIZE': int(os.environ.get('SESSION_CACHE_SIZE', 10000)),
+    'SESSION_CACHE_TTL': int(os.environ.get('SESSION_CACHE_TTL', 30)),
 }
 
-mongo = PyMongo(app)
+# Bound by create_app(); nothing connects until the first query
+mongo = PyMongo()
 
 def allowed_file(filename):
     return '.' in filename and \
@@ -46,6 +103,1058 @@ def allowed_file(filename):
 def is_admin():
     return session.get('is_admin', False)
 
+# ================== METRICS ==================
+
+# Histogram upper bounds: request latency in seconds, Mongo commands per request
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COMMAND_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21)
+# Commands issued outside any request (flushers, reconcilers) are filed here
+BACKGROUND_ROUTE = '<background>'
+MAX_SLOW_LOG_SHAPES = 50
+
+_request_state = threading.local()
+
+def query_shape(value):
+    """Replace the values in a query document with '?' so it can be logged"""
+    if isinstance(value, dict):
+        return {key: query_shape(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [query_shape(value[0])] if value else []
+    return '?'
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.total += value
+        self.count += 1
+
+class RequestMetrics(monitoring.CommandListener):
+    """Per-route request latency and MongoDB command counts, kept in memory.
+
+    Registered as a pymongo CommandListener; pymongo reports commands on the
+    thread that issued them, so each command is attributed to the request
+    that thread is serving.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = {}
+        self.latency = {}
+        self.commands_per_request = {}
+        self.commands = {}
+        self.command_seconds = {}
+
+    # pymongo listener hooks
+    def started(self, event):
+        state = getattr(_request_state, 'active', None)
+        if state is None:
+            with self._lock:
+                self.commands[BACKGROUND_ROUTE] = self.commands.get(BACKGROUND_ROUTE, 0) + 1
+            return
+        state['commands'] += 1
+        if state['shapes'] is not None and len(state['shapes']) < MAX_SLOW_LOG_SHAPES:
+            command = event.command
+            state['shapes'].append({
+                'command': event.command_name,
+                'collection': command.get(event.command_name),
+                'filter': query_shape(command.get('filter') or command.get('q') or command.get('query') or {}),
+                'pipeline': query_shape(command.get('pipeline', [])),
+            })
+
+    def succeeded(self, event):
+        self._finished(event)
+
+    def failed(self, event):
+        self._finished(event)
+
+    def _finished(self, event):
+        seconds = event.duration_micros / 1e6
+        state = getattr(_request_state, 'active', None)
+        if state is None:
+            with self._lock:
+                self.command_seconds[BACKGROUND_ROUTE] = self.command_seconds.get(BACKGROUND_ROUTE, 0) + seconds
+            return
+        state['command_seconds'] += seconds
+
+    # request hooks
+    def begin_request(self):
+        _request_state.active = {
+            'started': time.perf_counter(),
+            'commands': 0,
+            'command_seconds': 0.0,
+            'shapes': [] if APP_CONFIG['SLOW_REQUEST_MS'] else None,
+            # Until after_request sees a response, the view is assumed to have raised
+            'status': 500,
+        }
+
+    def set_status(self, status):
+        state = getattr(_request_state, 'active', None)
+        if state is not None:
+            state['status'] = status
+
+    def end_request(self, route, method):
+        state = getattr(_request_state, 'active', None)
+        if state is None:
+            return
+        _request_state.active = None
+        status = state['status']
+        elapsed = time.perf_counter() - state['started']
+        
+        with self._lock:
+            key = (route, method, str(status))
+            self.requests[key] = self.requests.get(key, 0) + 1
+            self.latency.setdefault(route, Histogram(LATENCY_BUCKETS)).observe(elapsed)
+            self.commands_per_request.setdefault(route, Histogram(COMMAND_BUCKETS)).observe(state['commands'])
+            self.commands[route] = self.commands.get(route, 0) + state['commands']
+            self.command_seconds[route] = self.command_seconds.get(route, 0) + state['command_seconds']
+        
+        slow_ms = APP_CONFIG['SLOW_REQUEST_MS']
+        if slow_ms and elapsed * 1000 >= slow_ms:
+            app.logger.warning('Slow request %s %s: %.1fms, %d Mongo commands (%.1fms) %s',
+                               method, route, elapsed * 1000, state['commands'],
+                               state['command_seconds'] * 1000, json.dumps(state['shapes'], default=str))
+
+    def render(self):
+        """Prometheus text exposition of everything collected so far"""
+        def label(value):
+            return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        
+        def histogram_lines(name, histograms):
+            lines = [f'# TYPE {name} histogram']
+            for route, histogram in sorted(histograms.items()):
+                cumulative = 0
+                for bound, count in zip(histogram.buckets + ('+Inf',), histogram.counts):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{{route="{label(route)}",le="{bound}"}} {cumulative}')
+                lines.append(f'{name}_sum{{route="{label(route)}"}} {histogram.total}')
+                lines.append(f'{name}_count{{route="{label(route)}"}} {histogram.count}')
+            return lines
+        
+        with self._lock:
+            lines = [
+                '# HELP garage_http_requests_total Requests handled, by route, method and status.',
+                '# TYPE garage_http_requests_total counter',
+            ]
+            for (route, method, status), count in sorted(self.requests.items()):
+                lines.append(f'garage_http_requests_total{{route="{label(route)}",method="{method}",status="{status}"}} {count}')
+            lines.append('# HELP garage_http_request_duration_seconds Request latency by route.')
+            lines += histogram_lines('garage_http_request_duration_seconds', self.latency)
+            lines.append('# HELP garage_mongo_commands_per_request MongoDB commands issued per request.')
+            lines += histogram_lines('garage_mongo_commands_per_request', self.commands_per_request)
+            lines += [
+                '# HELP garage_mongo_commands_total MongoDB commands issued, by route.',
+                '# TYPE garage_mongo_commands_total counter',
+            ]
+            for route, count in sorted(self.commands.items()):
+                lines.append(f'garage_mongo_commands_total{{route="{label(route)}"}} {count}')
+            lines += [
+                '# HELP garage_mongo_command_seconds_total Time spent in MongoDB commands, by route.',
+                '# TYPE garage_mongo_command_seconds_total counter',
+            ]
+            for route, seconds in sorted(self.command_seconds.items()):
+                lines.append(f'garage_mongo_command_seconds_total{{route="{label(route)}"}} {seconds}')
+        return '\n'.join(lines) + '\n'
+
+request_metrics = RequestMetrics()
+
+# The window opens in ServerSessionInterface.open_session and closes at
+# teardown, after the session has been saved, so both store calls count
+@app.after_request
+def record_request_status(response):
+    request_metrics.set_status(response.status_code)
+    return response
+
+@app.teardown_request
+def record_request_metrics(error):
+    # after_request doesn't run when a view raises, so those stay recorded as 500s
+    route = request.url_rule.rule if request.url_rule else '<unmatched>'
+    request_metrics.end_request(route, request.method)
+
+@app.route('/admin/metrics')
+def admin_metrics():
+    """Prometheus scrape endpoint: admin session or METRICS_TOKEN bearer token"""
+    token = APP_CONFIG['METRICS_TOKEN']
+    authorized = is_admin() or (token and request.headers.get('Authorization') == f'Bearer {token}')
+    if not authorized:
+        return jsonify({'success': False, 'error': 'Unauthorized'}), 401
+    
+    return request_metrics.render(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
+# ================== CAR TEMPLATE CACHE ==================
+
+class CarTemplateCache:
+    """In-process cache of car templates keyed by model_id.
+
+    Each worker keeps its own copy. Admin writes bump a version counter in
+    the ``cache_versions`` collection, and every worker re-checks that counter
+    at most once per ``ttl`` seconds, so changes made in another process
+    become visible within that delay.
+    """
+
+    VERSION_KEY = 'car_templates'
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        # (templates by model_id, templates in collection order, thresholds by model_id),
+        # swapped as one object so readers never mix two loads
+        self._snapshot = ({}, [], {})
+        self._version = None
+        self._checked_at = 0.0
+        self._loaded = False
+
+    def _remote_version(self):
+        doc = mongo.db.cache_versions.find_one({'_id': self.VERSION_KEY})
+        return doc['version'] if doc else 0
+
+    def _load(self, version):
+        templates = {}
+        ordered = []
+        thresholds = {}
+        for template in mongo.db.car_templates.find({}):
+            # Keep stages sorted so thresholds can be bisected
+            template['stages'] = sorted(template.get('stages', []), key=lambda stage: stage.get('threshold', 0))
+            templates[template['model_id']] = template
+            thresholds[template['model_id']] = [stage.get('threshold', 0) for stage in template['stages']]
+            ordered.append(template)
+
+        self._snapshot = (templates, ordered, thresholds)
+        self._version = version
+        self._loaded = True
+
+    def _ensure_fresh(self):
+        now = time.monotonic()
+        if self._loaded and now - self._checked_at < self.ttl:
+            return
+
+        with self._lock:
+            if self._loaded and now - self._checked_at < self.ttl:
+                return
+            # Read the version before the templates so a concurrent write
+            # is picked up on the next check rather than lost
+            version = self._remote_version()
+            if not self._loaded or version != self._version:
+                self._load(version)
+            self._checked_at = time.monotonic()
+
+    @property
+    def version(self):
+        self._ensure_fresh()
+        return self._version
+
+    def get(self, model_id):
+        """Return the template for model_id, or None. Do not mutate the result."""
+        self._ensure_fresh()
+        return self._snapshot[0].get(model_id)
+
+    def all(self):
+        """Return all templates in collection order. Do not mutate the result."""
+        self._ensure_fresh()
+        return list(self._snapshot[1])
+
+    def stage_for_progress(self, model_id, progress):
+        """Return the highest stage whose threshold is <= progress"""
+        self._ensure_fresh()
+        templates, _, thresholds = self._snapshot
+        template = templates.get(model_id)
+        if not template or not template['stages']:
+            return None
+
+        index = bisect_right(thresholds[model_id], progress) - 1
+        return template['stages'][max(index, 0)]
+
+    def invalidate(self):
+        """Drop the local copy and tell the other workers to reload"""
+        mongo.db.cache_versions.update_one(
+            {'_id': self.VERSION_KEY},
+            {'$inc': {'version': 1}},
+            upsert=True
+        )
+        with self._lock:
+            self._loaded = False
+
+template_cache = CarTemplateCache(APP_CONFIG['TEMPLATE_CACHE_TTL'])
+
+# ================== LIVE SESSIONS ==================
+
+# Allowance for client/server clock drift when checking reported minutes
+CLOCK_SLACK_MINUTES = 1
+
+def verified_minutes(active_session, claimed_minutes, now=None):
+    """Clamp client-reported minutes to the session's duration and the wall-clock time since it started"""
+    now = now or datetime.utcnow()
+    started_at = datetime.fromisoformat(active_session['start_time'])
+    elapsed = (now - started_at).total_seconds() / 60
+    limit = elapsed + CLOCK_SLACK_MINUTES
+    if active_session.get('duration_minutes'):
+        # The timer stops at the chosen duration, however late the result arrives
+        limit = min(limit, active_session['duration_minutes'] + CLOCK_SLACK_MINUTES)
+    return max(0, min(claimed_minutes, limit))
+
+def client_minutes(value):
+    """Minutes reported by the client, or 0 when they aren't a number"""
+    try:
+        return float(value or 0)
+    except (TypeError, ValueError):
+        return 0.0
+
+class LiveSessionRegistry:
+    """Write-behind buffer of in-flight focus sessions.
+
+    Session starts, heartbeats and ends are collected per user in memory and
+    written to ``live_sessions`` with one ``bulk_write`` every
+    ``flush_interval`` seconds, when ``max_pending`` users are buffered, and
+    at shutdown. Documents that stop receiving heartbeats are removed by the
+    TTL index on ``last_heartbeat``.
+    """
+
+    def __init__(self, flush_interval, max_pending, expiry_seconds):
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.expiry_seconds = expiry_seconds
+        self._lock = threading.Lock()
+        self._pending = OrderedDict()
+        self._flusher_pid = None
+
+    def _ensure_flusher(self):
+        # Threads don't survive fork, so each worker process starts its own
+        if self._flusher_pid == os.getpid():
+            return
+        with self._lock:
+            if self._flusher_pid == os.getpid():
+                return
+            self._flusher_pid = os.getpid()
+            threading.Thread(target=self._run, name='live-session-flusher', daemon=True).start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception:
+                app.logger.exception('Live session flush failed')
+
+    def _record(self, user_id, state):
+        self._ensure_flusher()
+        with self._lock:
+            # Later events for the same user are merged into earlier ones
+            previous = self._pending.pop(user_id, None)
+            if state is not None and previous:
+                state = {**previous, **state}
+            self._pending[user_id] = state
+            full = len(self._pending) >= self.max_pending
+        if full:
+            self.flush()
+
+    @staticmethod
+    def _state(active_session, mode, elapsed_minutes, last_heartbeat):
+        state = {
+            'started_at': datetime.fromisoformat(active_session['start_time']),
+            'duration_minutes': active_session['duration_minutes'],
+            'task_description': active_session['task_description'],
+            'car_id': active_session.get('car_id'),
+            'elapsed_minutes': elapsed_minutes,
+            'last_heartbeat': last_heartbeat
+        }
+        # Heartbeats from older clients don't report the mode; keep the stored one
+        if mode:
+            state['mode'] = mode
+        return state
+
+    def start(self, user_id, active_session, mode=None):
+        started_at = datetime.fromisoformat(active_session['start_time'])
+        self._record(user_id, self._state(active_session, mode, 0, started_at))
+
+    def heartbeat(self, user_id, active_session, elapsed_minutes, mode=None):
+        now = datetime.utcnow()
+        elapsed_minutes = verified_minutes(active_session, elapsed_minutes, now)
+        self._record(user_id, self._state(active_session, mode, elapsed_minutes, now))
+
+    def end(self, user_id):
+        self._record(user_id, None)
+
+    def flush(self):
+        """Write all buffered changes in a single bulk_write"""
+        with self._lock:
+            pending, self._pending = self._pending, OrderedDict()
+        if not pending:
+            return 0
+
+        operations = []
+        for user_id, state in pending.items():
+            if state is None:
+                operations.append(DeleteOne({'_id': user_id}))
+            else:
+                operations.append(UpdateOne({'_id': user_id}, {'$set': state}, upsert=True))
+        mongo.db.live_sessions.bulk_write(operations, ordered=False)
+        return len(operations)
+
+    def focusing_users(self, limit=100):
+        """Return live sessions that sent a heartbeat within the expiry window"""
+        self.flush()
+        cutoff = datetime.utcnow() - timedelta(seconds=self.expiry_seconds)
+        return list(mongo.db.live_sessions.find(
+            {'last_heartbeat': {'$gte': cutoff}}
+        ).sort('last_heartbeat', DESCENDING).limit(limit))
+
+    def count_focusing(self):
+        self.flush()
+        cutoff = datetime.utcnow() - timedelta(seconds=self.expiry_seconds)
+        return mongo.db.live_sessions.count_documents({'last_heartbeat': {'$gte': cutoff}})
+
+live_sessions = LiveSessionRegistry(
+    APP_CONFIG['LIVE_FLUSH_INTERVAL'],
+    APP_CONFIG['LIVE_MAX_PENDING'],
+    APP_CONFIG['LIVE_SESSION_EXPIRY']
+)
+atexit.register(live_sessions.flush)
+
+# ================== SERVER-SIDE SESSIONS ==================
+
+SESSION_ID_PATTERN = re.compile(r'[A-Za-z0-9_-]{43}')
+
+class ServerSession(CallbackDict, SessionMixin):
+    """Session data held on the server; the cookie only carries ``<sid>.<revision>``"""
+
+    def __init__(self, initial=None, sid=None, revision=0, expires_at=None):
+        def on_update(self):
+            self.modified = True
+            self.accessed = True
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.revision = revision
+        self.expires_at = expires_at
+        self.modified = False
+        # Only responses that read the session vary by cookie; as in SecureCookieSession
+        self.accessed = False
+        self.replaced_sid = None
+
+    def __getitem__(self, key):
+        self.accessed = True
+        return super().__getitem__(key)
+
+    def get(self, key, default=None):
+        self.accessed = True
+        return super().get(key, default)
+
+    def setdefault(self, key, default=None):
+        self.accessed = True
+        return super().setdefault(key, default)
+
+    def regenerate(self):
+        """Move the data to a new ID on the next save, so an ID issued before login can't be reused"""
+        if self.sid and not self.replaced_sid:
+            self.replaced_sid = self.sid
+        self.sid = None
+        self.modified = True
+
+class MongoSessionStore:
+    """Session documents in ``sessions``; a TTL index on expires_at removes expired ones"""
+
+    def load(self, sid):
+        # The TTL monitor only runs once a minute, so check expiry here too
+        return mongo.db.sessions.find_one({'_id': sid, 'expires_at': {'$gt': datetime.utcnow()}})
+
+    def save(self, sid, data, revision, expires_at):
+        mongo.db.sessions.replace_one(
+            {'_id': sid},
+            {'data': data, 'revision': revision, 'expires_at': expires_at, 'updated_at': datetime.utcnow()},
+            upsert=True
+        )
+
+    def touch(self, sid, expires_at):
+        mongo.db.sessions.update_one({'_id': sid}, {'$set': {'expires_at': expires_at}})
+
+    def delete(self, sid):
+        mongo.db.sessions.delete_one({'_id': sid})
+
+class ServerSessionInterface(SessionInterface):
+    """Flask sessions kept in a server-side store, with a per-worker LRU in front of it.
+
+    ``store`` provides load/save/touch/delete, as MongoSessionStore does.
+    The cookie names the session and the revision of its last write, so a
+    worker serves its cached copy only while that revision matches; a write
+    made through another worker always misses the cache. Sessions are saved
+    only when their data changes, and an idle session's expiry is pushed back
+    at most once per half ``lifetime``.
+    """
+
+    def __init__(self, store, lifetime, cache_size, cache_ttl):
+        self.store = store
+        self.lifetime = lifetime
+        self.cache_size = cache_size
+        self.cache_ttl = cache_ttl
+        self._lock = threading.Lock()
+        # sid -> (revision, data, expires_at, cached_at), least recently used first
+        self._cache = OrderedDict()
+
+    def _cached(self, sid, revision):
+        with self._lock:
+            entry = self._cache.get(sid)
+            if entry is None:
+                return None
+            if entry[0] != revision or time.monotonic() - entry[3] > self.cache_ttl:
+                del self._cache[sid]
+                return None
+            self._cache.move_to_end(sid)
+            return entry
+
+    def _remember(self, sid, revision, data, expires_at):
+        with self._lock:
+            self._cache[sid] = (revision, copy.deepcopy(data), expires_at, time.monotonic())
+            self._cache.move_to_end(sid)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def _forget(self, sid):
+        with self._lock:
+            self._cache.pop(sid, None)
+
+    def open_session(self, app, request):
+        # Flask opens the session before any before_request hook runs, so the
+        # request's metrics window starts here to count the session lookup too
+        request_metrics.begin_request()
+        sid, _, revision = request.cookies.get(self.get_cookie_name(app), '').partition('.')
+        if not SESSION_ID_PATTERN.fullmatch(sid) or not revision.isdigit():
+            return ServerSession()
+        
+        entry = self._cached(sid, int(revision))
+        if entry and entry[2] > datetime.utcnow():
+            # Copied so changes made in this request don't leak into the cache unsaved
+            return ServerSession(copy.deepcopy(entry[1]), sid, entry[0], entry[2])
+        
+        document = self.store.load(sid)
+        if not document:
+            return ServerSession()
+        self._remember(sid, document['revision'], document['data'], document['expires_at'])
+        return ServerSession(document['data'], sid, document['revision'], document['expires_at'])
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        secure = self.get_cookie_secure(app)
+        samesite = self.get_cookie_samesite(app)
+        httponly = self.get_cookie_httponly(app)
+        
+        if session.accessed:
+            response.vary.add('Cookie')
+        
+        now = datetime.utcnow()
+        if not session.modified:
+            if session.sid and session.expires_at - now < timedelta(seconds=self.lifetime / 2):
+                expires_at = now + timedelta(seconds=self.lifetime)
+                self.store.touch(session.sid, expires_at)
+                self._remember(session.sid, session.revision, dict(session), expires_at)
+            return
+        
+        if session.replaced_sid:
+            self.store.delete(session.replaced_sid)
+            self._forget(session.replaced_sid)
+        
+        if not session:
+            if session.sid:
+                self.store.delete(session.sid)
+                self._forget(session.sid)
+            if session.sid or session.replaced_sid:
+                response.delete_cookie(name, domain=domain, path=path, secure=secure,
+                                       samesite=samesite, httponly=httponly)
+            return
+        
+        sid = session.sid or secrets.token_urlsafe(32)
+        revision = session.revision + 1
+        expires_at = now + timedelta(seconds=self.lifetime)
+        data = dict(session)
+        self.store.save(sid, data, revision, expires_at)
+        self._remember(sid, revision, data, expires_at)
+        response.set_cookie(
+            name, f'{sid}.{revision}',
+            expires=self.get_expiration_time(app, session),
+            httponly=httponly, domain=domain, path=path, secure=secure, samesite=samesite
+        )
+
+server_sessions = ServerSessionInterface(
+    MongoSessionStore(),
+    APP_CONFIG['SESSION_TIMEOUT'],
+    APP_CONFIG['SESSION_CACHE_SIZE'],
+    APP_CONFIG['SESSION_CACHE_TTL']
+)
+app.session_interface = server_sessions
+
+# ================== PASSWORD HASHING ==================
+
+# Usernames with recent failed logins tracked per worker, oldest dropped first
+MAX_TRACKED_LOGINS = 10000
+
+class HashingBusy(Exception):
+    """The hashing pool is saturated (429) or didn't answer in time (503)"""
+
+    def __init__(self, status):
+        super().__init__(f'Password hashing unavailable ({status})')
+        self.status = status
+        self.retry_after = 5
+
+class LoginThrottled(HashingBusy):
+    """Too many failed logins for one username recently (429)"""
+
+    def __init__(self, retry_after):
+        super().__init__(429)
+        self.retry_after = retry_after
+
+class PasswordHasher:
+    """Password hashing on a small bounded thread pool.
+
+    hashlib releases the GIL while hashing, so ``workers`` caps how many
+    cores logins can take from the rest of the worker. At most
+    ``queue_depth`` more hashes may wait; beyond that callers get
+    ``HashingBusy(429)`` straight away instead of queueing behind a login
+    storm, and ``HashingBusy(503)`` if their hash doesn't finish within
+    ``timeout`` seconds.
+
+    Each username gets ``max_failed_logins`` attempts per
+    ``failed_login_ttl`` seconds; further ones raise ``LoginThrottled``
+    without hashing until the window ends or a login succeeds.
+    """
+
+    def __init__(self, method, workers, queue_depth, timeout, failed_login_ttl, max_failed_logins):
+        self.method = method
+        self.workers = workers
+        self.queue_depth = queue_depth
+        self.timeout = timeout
+        self.failed_login_ttl = failed_login_ttl
+        self.max_failed_logins = max_failed_logins
+        self._lock = threading.Lock()
+        self._executor = None
+        self._slots = None
+        self._executor_pid = None
+        self._prefixes = {}
+        self._failed = OrderedDict()
+
+    def _pool(self):
+        # Threads don't survive fork, so each worker process gets its own pool
+        if self._executor_pid != os.getpid():
+            with self._lock:
+                if self._executor_pid != os.getpid():
+                    self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='password-hash')
+                    self._slots = threading.BoundedSemaphore(self.workers + self.queue_depth)
+                    self._executor_pid = os.getpid()
+        return self._executor, self._slots
+
+    def _submit(self, fn, *args):
+        executor, slots = self._pool()
+        if not slots.acquire(blocking=False):
+            raise HashingBusy(429)
+        try:
+            future = executor.submit(fn, *args)
+        except Exception:
+            slots.release()
+            raise
+        future.add_done_callback(lambda _: slots.release())
+        return future
+
+    def _run(self, fn, *args):
+        try:
+            return self._submit(fn, *args).result(timeout=self.timeout)
+        except FutureTimeout:
+            raise HashingBusy(503)
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password, self.method)
+
+    def verify(self, username, stored_hash, password):
+        """Check a login, refusing usernames with too many recent failures without hashing"""
+        now = time.monotonic()
+        with self._lock:
+            window_start, attempts = self._failed.pop(username, (now, 0))
+            if now - window_start >= self.failed_login_ttl:
+                window_start, attempts = now, 0
+            if attempts >= self.max_failed_logins:
+                self._failed[username] = (window_start, attempts)
+                raise LoginThrottled(math.ceil(window_start + self.failed_login_ttl - now))
+            # Counted before hashing so a burst of parallel guesses can't overshoot the limit
+            self._failed[username] = (window_start, attempts + 1)
+            while len(self._failed) > MAX_TRACKED_LOGINS:
+                self._failed.popitem(last=False)
+        
+        if self._run(check_password_hash, stored_hash, password):
+            with self._lock:
+                self._failed.pop(username, None)
+            return True
+        return False
+
+    def _needs_rehash(self, stored_hash):
+        if self.method not in self._prefixes:
+            # werkzeug fills in default costs, so hash once to learn the stored form
+            self._prefixes[self.method] = generate_password_hash('', self.method).split('$', 1)[0]
+        return stored_hash.split('$', 1)[0] != self._prefixes[self.method]
+
+    def _rehash(self, user_id, stored_hash, password):
+        if not self._needs_rehash(stored_hash):
+            return
+        # Only replace the hash we verified, in case the password changed meanwhile
+        mongo.db.users.update_one(
+            {'_id': user_id, 'password': stored_hash},
+            {'$set': {'password': generate_password_hash(password, self.method)}}
+        )
+
+    def upgrade(self, user_id, stored_hash, password):
+        """Re-hash a verified password with the current method in the background"""
+        try:
+            future = self._submit(self._rehash, user_id, stored_hash, password)
+        except HashingBusy:
+            return  # Busy; the next login will try again
+        future.add_done_callback(
+            lambda done: done.exception() and app.logger.error('Password rehash failed: %s', done.exception())
+        )
+
+password_hasher = PasswordHasher(
+    APP_CONFIG['PASSWORD_HASH_METHOD'],
+    APP_CONFIG['HASH_WORKERS'],
+    APP_CONFIG['HASH_QUEUE_DEPTH'],
+    APP_CONFIG['HASH_TIMEOUT'],
+    APP_CONFIG['FAILED_LOGIN_TTL'],
+    APP_CONFIG['MAX_FAILED_LOGINS']
+)
+
+def hashing_busy_response(template, error):
+    """Render a form page with a retryable error for a saturated hashing pool"""
+    if isinstance(error, LoginThrottled):
+        message = 'Too many failed sign-ins for this account, please try again later'
+    elif error.status == 429:
+        message = 'Too many sign-ins right now, please try again in a few seconds'
+    else:
+        message = 'Sign-in is taking too long right now, please try again shortly'
+    return render_template(template, error=message), error.status, {'Retry-After': str(error.retry_after)}
+
+# ================== DASHBOARD STATISTICS ==================
+
+class DashboardStats:
+    """Counters for the admin dashboard, kept in a single ``app_stats`` document.
+
+    Write paths add deltas to a per-worker buffer, applied with one ``$inc``
+    every ``flush_interval`` seconds and at shutdown, so the dashboard reads
+    one document instead of counting collections. A background job recomputes
+    everything from scratch every ``reconcile_interval`` seconds to correct
+    drift; workers race for the job through a conditional update so only one
+    of them runs it per interval.
+    """
+
+    DOC_ID = 'global'
+    COUNTERS = ('total_users', 'total_cars', 'completed_cars', 'car_templates', 'total_focus_minutes')
+
+    def __init__(self, reconcile_interval, flush_interval):
+        self.reconcile_interval = reconcile_interval
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._reconciler_pid = None
+
+    def _ensure_reconciler(self):
+        if self._reconciler_pid == os.getpid():
+            return
+        with self._lock:
+            if self._reconciler_pid == os.getpid():
+                return
+            self._reconciler_pid = os.getpid()
+            threading.Thread(target=self._run, name='stats-reconciler', daemon=True).start()
+
+    def _run(self):
+        reconcile_due = time.monotonic() + self.reconcile_interval
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception:
+                app.logger.exception('Stats flush failed')
+            if time.monotonic() < reconcile_due:
+                continue
+            reconcile_due = time.monotonic() + self.reconcile_interval
+            try:
+                if self._claim():
+                    self.reconcile()
+            except Exception:
+                app.logger.exception('Stats reconciliation failed')
+
+    def _claim(self):
+        """Return True if this worker won the right to reconcile this interval"""
+        now = datetime.utcnow()
+        cutoff = now - timedelta(seconds=self.reconcile_interval)
+        result = mongo.db.app_stats.update_one(
+            {'_id': self.DOC_ID, 'reconcile_claimed_at': {'$not': {'$gt': cutoff}}},
+            {'$set': {'reconcile_claimed_at': now}}
+        )
+        return result.modified_count == 1
+
+    def increment(self, **deltas):
+        self._ensure_reconciler()
+        with self._lock:
+            for name, delta in deltas.items():
+                self._pending[name] = self._pending.get(name, 0) + delta
+
+    def flush(self):
+        """Apply the buffered deltas in a single update"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return
+        mongo.db.app_stats.update_one(
+            {'_id': self.DOC_ID},
+            {'$inc': pending},
+            upsert=True
+        )
+
+    def reconcile(self):
+        """Recompute every counter from the collections"""
+        # This worker's deltas are already in the collections; don't add them again afterwards
+        self.flush()
+        focus_total = list(mongo.db.user_cars.aggregate([
+            {'$group': {'_id': None, 'total': {'$sum': '$total_focus_minutes'}}}
+        ]))
+        counters = {
+            'total_users': mongo.db.users.count_documents({}),
+            'total_cars': mongo.db.user_cars.count_documents({}),
+            'completed_cars': mongo.db.user_cars.count_documents({'is_completed': True}),
+            'car_templates': mongo.db.car_templates.count_documents({}),
+            'total_focus_minutes': focus_total[0]['total'] if focus_total else 0,
+            'reconciled_at': datetime.utcnow()
+        }
+        mongo.db.app_stats.update_one({'_id': self.DOC_ID}, {'$set': counters}, upsert=True)
+        return counters
+
+    def get(self):
+        self._ensure_reconciler()
+        self.flush()
+        stats = mongo.db.app_stats.find_one({'_id': self.DOC_ID})
+        if not stats or 'reconciled_at' not in stats:
+            # First run: build the counters before trusting the increments
+            stats = self.reconcile()
+        return {name: stats.get(name, 0) for name in self.COUNTERS}
+
+dashboard_stats = DashboardStats(APP_CONFIG['STATS_RECONCILE_INTERVAL'], APP_CONFIG['STATS_FLUSH_INTERVAL'])
+atexit.register(dashboard_stats.flush)
+
+@app.cli.command('reconcile-stats')
+def reconcile_stats_command():
+    """Recompute the admin dashboard counters from scratch."""
+    counters = dashboard_stats.reconcile()
+    for name in DashboardStats.COUNTERS:
+        click.echo(f'{name}: {counters[name]}')
+
+# ================== FOCUS ROLLUPS ==================
+
+# Periods rolled up per user; 'all' holds the all-time total
+ROLLUP_PERIODS = ('day', 'week', 'all')
+MAX_HISTORY_BUCKETS = 366
+MAX_LEADERBOARD_SIZE = 100
+ROLLUP_BATCH_SIZE = 1000
+
+def period_start(period, when):
+    """Start (UTC midnight) of the day or Monday-based week containing ``when``; None for 'all'"""
+    if period == 'all':
+        return None
+    day = datetime(when.year, when.month, when.day)
+    if period == 'week':
+        day -= timedelta(days=day.weekday())
+    return day
+
+def rollup_id(user_id, period, start):
+    if start is None:
+        return f"{user_id}:{period}"
+    return f"{user_id}:{period}:{start.strftime('%Y-%m-%d')}"
+
+class FocusRollupBuffer:
+    """Write-behind buffer of rollup deltas from completed sessions.
+
+    Sessions are added to their user's day, week and all-time buckets in
+    memory and written to ``focus_rollups`` with one ``bulk_write`` every
+    ``flush_interval`` seconds, when ``max_pending`` buckets are buffered,
+    and at shutdown. The buckets double as leaderboard entries: the
+    (period, start, minutes) index makes any top-N an index walk of N
+    documents. Readers flush first, so only other workers' sessions can
+    lag by up to ``flush_interval``.
+    """
+
+    def __init__(self, flush_interval, max_pending):
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._flusher_pid = None
+
+    def _ensure_flusher(self):
+        # Threads don't survive fork, so each worker process starts its own
+        if self._flusher_pid == os.getpid():
+            return
+        with self._lock:
+            if self._flusher_pid == os.getpid():
+                return
+            self._flusher_pid = os.getpid()
+            threading.Thread(target=self._run, name='rollup-flusher', daemon=True).start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception:
+                app.logger.exception('Focus rollup flush failed')
+
+    def record(self, user_id, username, sessions):
+        """Add (minutes, completed_at) sessions to the user's buckets"""
+        self._ensure_flusher()
+        with self._lock:
+            for minutes, when in sessions:
+                for period in ROLLUP_PERIODS:
+                    start = period_start(period, when)
+                    bucket = self._pending.setdefault(rollup_id(user_id, period, start), {
+                        'user_id': user_id, 'username': username, 'period': period, 'start': start,
+                        'minutes': 0, 'sessions': 0, 'updated_at': when
+                    })
+                    bucket['minutes'] += minutes
+                    bucket['sessions'] += 1
+                    bucket['updated_at'] = max(bucket['updated_at'], when)
+            full = len(self._pending) >= self.max_pending
+        if full:
+            self.flush()
+
+    def flush(self):
+        """Write all buffered deltas in a single bulk_write"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+        
+        operations = [
+            UpdateOne(
+                {'_id': bucket_id},
+                {
+                    '$inc': {'minutes': bucket['minutes'], 'sessions': bucket['sessions']},
+                    '$max': {'updated_at': bucket['updated_at']},
+                    '$setOnInsert': {'user_id': bucket['user_id'], 'username': bucket['username'],
+                                     'period': bucket['period'], 'start': bucket['start']}
+                },
+                upsert=True
+            )
+            for bucket_id, bucket in pending.items()
+        ]
+        mongo.db.focus_rollups.bulk_write(operations, ordered=False)
+        return len(operations)
+
+rollup_buffer = FocusRollupBuffer(APP_CONFIG['ROLLUP_FLUSH_INTERVAL'], APP_CONFIG['ROLLUP_MAX_PENDING'])
+atexit.register(rollup_buffer.flush)
+
+def streak_update(day):
+    """Pipeline stages that extend or restart the user's daily focus streak"""
+    previous_day = day - timedelta(days=1)
+    return [
+        {'$set': {
+            'focus_streak': {'$switch': {
+                'branches': [
+                    # Same day, or a late-synced session from before the last focus day
+                    {'case': {'$gte': ['$last_focus_day', day]}, 'then': {'$ifNull': ['$focus_streak', 1]}},
+                    {'case': {'$eq': ['$last_focus_day', previous_day]}, 'then': {'$add': [{'$ifNull': ['$focus_streak', 0]}, 1]}}
+                ],
+                'default': 1
+            }},
+            'last_focus_day': {'$max': ['$last_focus_day', day]}
+        }},
+        {'$set': {'longest_focus_streak': {'$max': ['$longest_focus_streak', '$focus_streak']}}}
+    ]
+
+def current_streak(user, today=None):
+    """A streak only counts if the user focused today or yesterday"""
+    today = today or period_start('day', datetime.utcnow())
+    last_day = user.get('last_focus_day')
+    if not last_day or today - last_day > timedelta(days=1):
+        return 0
+    return user.get('focus_streak', 0)
+
+def rebuild_focus_rollups():
+    """Recompute every rollup bucket and streak from the session ledger.
+
+    Day and week buckets come from ``focus_sessions``; the all-time bucket
+    uses ``user_cars.total_focus_minutes`` so time logged before the ledger
+    existed still counts. Returns the number of buckets written.
+    """
+    rebuilt_at = datetime.utcnow()
+    usernames = {str(user['_id']): user['username'] for user in mongo.db.users.find({}, {'username': 1})}
+    buckets = {}
+    days_by_user = {}
+    
+    daily = mongo.db.focus_sessions.aggregate([
+        {'$match': {'abandoned': {'$ne': True}}},
+        {'$group': {
+            '_id': {'user_id': '$user_id', 'day': {'$dateToString': {'format': '%Y-%m-%d', 'date': '$completed_at'}}},
+            'minutes': {'$sum': '$minutes_focused'},
+            'sessions': {'$sum': 1}
+        }}
+    ], allowDiskUse=True)
+    for row in daily:
+        user_id = row['_id']['user_id']
+        day = datetime.strptime(row['_id']['day'], '%Y-%m-%d')
+        days_by_user.setdefault(user_id, []).append(day)
+        for period in ('day', 'week', 'all'):
+            start = period_start(period, day)
+            bucket = buckets.setdefault(rollup_id(user_id, period, start), {
+                'user_id': user_id, 'username': usernames.get(user_id), 'period': period,
+                'start': start, 'minutes': 0, 'sessions': 0
+            })
+            bucket['sessions'] += row['sessions']
+            if period != 'all':
+                bucket['minutes'] += row['minutes']
+    
+    totals = mongo.db.user_cars.aggregate([
+        {'$group': {'_id': '$user_id', 'minutes': {'$sum': '$total_focus_minutes'}}}
+    ])
+    for row in totals:
+        if not row['minutes']:
+            continue
+        user_id = row['_id']
+        bucket = buckets.setdefault(rollup_id(user_id, 'all', None), {
+            'user_id': user_id, 'username': usernames.get(user_id), 'period': 'all',
+            'start': None, 'minutes': 0, 'sessions': 0
+        })
+        bucket['minutes'] = row['minutes']
+    
+    operations = [
+        ReplaceOne({'_id': bucket_id}, {**bucket, 'updated_at': rebuilt_at}, upsert=True)
+        for bucket_id, bucket in buckets.items()
+    ]
+    for i in range(0, len(operations), ROLLUP_BATCH_SIZE):
+        mongo.db.focus_rollups.bulk_write(operations[i:i + ROLLUP_BATCH_SIZE], ordered=False)
+    mongo.db.focus_rollups.delete_many({'updated_at': {'$lt': rebuilt_at}})
+    
+    # Streaks: the run of consecutive days ending at each user's last focus day
+    streak_updates = []
+    for user_id, days in days_by_user.items():
+        if not ObjectId.is_valid(user_id):
+            continue
+        days.sort()
+        longest = run = 1
+        for previous, day in zip(days, days[1:]):
+            run = run + 1 if day - previous == timedelta(days=1) else 1
+            longest = max(longest, run)
+        streak_updates.append(UpdateOne({'_id': ObjectId(user_id)}, {'$set': {
+            'focus_streak': run,
+            'longest_focus_streak': longest,
+            'last_focus_day': days[-1]
+        }}))
+    for i in range(0, len(streak_updates), ROLLUP_BATCH_SIZE):
+        mongo.db.users.bulk_write(streak_updates[i:i + ROLLUP_BATCH_SIZE], ordered=False)
+    return len(operations)
+
+@app.cli.command('backfill-rollups')
+def backfill_rollups_command():
+    """Rebuild focus history, leaderboards and streaks from existing sessions."""
+    written = rebuild_focus_rollups()
+    click.echo(f'Rebuilt {written} focus rollup buckets')
+
 # Initialize car templates data
 def init_car_templates():
     """Initialize the car templates collection with default data"""
@@ -76,35 +1185,946 @@ def init_car_templates():
                 ]
             }
         ]
-        mongo.db.car_templates.insert_many(templates)
+        mongo.db.car_templates.insert_many(templates)
+        template_cache.invalidate()
+        dashboard_stats.increment(car_templates=len(templates))
+
+# ================== STREAMING UPLOADS ==================
+
+class HashingUploadFile:
+    """Temporary file that hashes upload data as Werkzeug streams it in"""
+
+    def __init__(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        self._file = tempfile.NamedTemporaryFile(dir=directory, prefix='upload-', delete=False)
+        self.path = self._file.name
+        self.digest = hashlib.sha256()
+        self.size = 0
+
+    def write(self, data):
+        self.digest.update(data)
+        self.size += len(data)
+        return self._file.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+
+    def discard(self):
+        self._file.close()
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+class GarageRequest(Request):
+    """Request class that streams admin uploads straight to hashed temp files"""
+
+    @property
+    def max_content_length(self):
+        # The per-type limit is checked once the asset type is known
+        if self.endpoint == 'admin_upload':
+            return max(APP_CONFIG['MAX_UPLOAD_MB_2D'], APP_CONFIG['MAX_UPLOAD_MB_3D']) * 1024 * 1024
+        return super().max_content_length
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if self.endpoint != 'admin_upload':
+            return super()._get_file_stream(total_content_length, content_type, filename, content_length)
+        stream = HashingUploadFile(os.path.join(app.config['UPLOAD_FOLDER'], '.incoming'))
+        self.__dict__.setdefault('_upload_streams', []).append(stream)
+        return stream
+
+    def close(self):
+        super().close()
+        # Anything not moved into place by store_upload is left over
+        for stream in self.__dict__.get('_upload_streams', []):
+            stream.discard()
+
+app.request_class = GarageRequest
+
+# Text-based model formats worth storing a gzip variant of
+GZIP_EXTENSIONS = {'gltf', 'obj'}
+
+def precompress_asset(file_path):
+    """Write file_path.gz next to a text-based asset if it actually saves space"""
+    if file_path.rsplit('.', 1)[-1].lower() not in GZIP_EXTENSIONS:
+        return False
+    gz_path = file_path + '.gz'
+    if os.path.exists(gz_path):
+        return True
+    
+    tmp_path = gz_path + '.tmp'
+    with open(file_path, 'rb') as source, gzip.open(tmp_path, 'wb', compresslevel=9) as target:
+        shutil.copyfileobj(source, target)
+    if os.path.getsize(tmp_path) >= os.path.getsize(file_path):
+        os.remove(tmp_path)
+        return False
+    os.replace(tmp_path, gz_path)
+    return True
+
+def upload_limit(asset_type):
+    return APP_CONFIG['MAX_UPLOAD_MB_3D' if asset_type == '3d' else 'MAX_UPLOAD_MB_2D'] * 1024 * 1024
+
+def store_upload(file, asset_type):
+    """Move a streamed upload to its content-addressed name.
+
+    Returns (filename, size, already_stored). Identical content maps to the
+    same name, so a re-upload skips the write and reuses the existing file.
+    """
+    stream = file.stream
+    extension = file.filename.rsplit('.', 1)[1].lower()
+    filename = f"{stream.digest.hexdigest()}.{extension}"
+    
+    upload_path = os.path.join(app.config['UPLOAD_FOLDER'], asset_type)
+    os.makedirs(upload_path, exist_ok=True)
+    file_path = os.path.join(upload_path, filename)
+    if os.path.exists(file_path):
+        return filename, stream.size, True
+    
+    stream.close()
+    os.chmod(stream.path, 0o644)
+    os.replace(stream.path, file_path)
+    precompress_asset(file_path)
+    return filename, stream.size, False
+
+# ================== ASSET MANIFEST ==================
+
+ASSET_TYPES = ('2d', '3d')
+ASSETS_PER_PAGE = 50
+
+def asset_url(asset_type, filename):
+    return f"/assets/uploads/{asset_type}/{filename}"
+
+def record_asset(asset_type, filename, size, car_id=None, stage_threshold=None, uploaded_at=None, metadata=None):
+    """Add or refresh an uploaded file in the uploaded_assets manifest"""
+    fields = {
+        'url': asset_url(asset_type, filename),
+        'size': size,
+        'car_id': car_id,
+        'stage_threshold': stage_threshold,
+        'uploaded_at': uploaded_at or datetime.utcnow()
+    }
+    if metadata:
+        fields['metadata'] = metadata
+    mongo.db.uploaded_assets.update_one(
+        {'type': asset_type, 'filename': filename},
+        {'$set': fields},
+        upsert=True
+    )
+
+def reconcile_asset_manifest():
+    """Bring uploaded_assets back in sync with the upload folders on disk"""
+    added = updated = removed = 0
+    for asset_type in ASSET_TYPES:
+        type_path = os.path.join(app.config['UPLOAD_FOLDER'], asset_type)
+        on_disk = {}
+        if os.path.isdir(type_path):
+            with os.scandir(type_path) as entries:
+                for entry in entries:
+                    # Skip precompressed variants; they belong to their source file
+                    if entry.is_file() and not entry.name.endswith('.gz'):
+                        on_disk[entry.name] = entry.stat()
+
+        known = {
+            asset['filename']: asset
+            for asset in mongo.db.uploaded_assets.find({'type': asset_type}, {'filename': 1, 'size': 1})
+        }
+
+        operations = []
+        for filename, stat in on_disk.items():
+            asset = known.get(filename)
+            if asset is None:
+                operations.append(UpdateOne(
+                    {'type': asset_type, 'filename': filename},
+                    {'$set': {
+                        'url': asset_url(asset_type, filename),
+                        'size': stat.st_size,
+                        'car_id': None,
+                        'stage_threshold': None,
+                        'uploaded_at': datetime.utcfromtimestamp(stat.st_mtime)
+                    }},
+                    upsert=True
+                ))
+                added += 1
+            elif asset.get('size') != stat.st_size:
+                operations.append(UpdateOne({'_id': asset['_id']}, {'$set': {'size': stat.st_size}}))
+                updated += 1
+
+        for filename, asset in known.items():
+            if filename not in on_disk:
+                operations.append(DeleteOne({'_id': asset['_id']}))
+                removed += 1
+
+        if operations:
+            mongo.db.uploaded_assets.bulk_write(operations, ordered=False)
+
+    return added, updated, removed
+
+# ================== IMAGE DERIVATIVES ==================
+
+# Generated files live outside the 2d/3d folders so the manifest ignores them
+DERIVED_FOLDER = 'derived'
+# Longest edge in pixels for each resized variant of a 2D stage image
+IMAGE_VARIANTS = {'thumb': 160, 'card': 480, 'full': 1280}
+
+def render_image_variants(source_path, output_dir, stem):
+    """Resize and re-encode one image into every variant. Runs in a worker process."""
+    from PIL import Image, ImageOps
+    
+    os.makedirs(output_dir, exist_ok=True)
+    variants = {}
+    with Image.open(source_path) as source:
+        image = ImageOps.exif_transpose(source)
+        if image.mode not in ('RGB', 'RGBA'):
+            has_alpha = image.mode in ('LA', 'PA') or 'transparency' in image.info
+            image = image.convert('RGBA' if has_alpha else 'RGB')
+        
+        for variant, max_size in IMAGE_VARIANTS.items():
+            resized = image.copy()
+            resized.thumbnail((max_size, max_size), Image.LANCZOS)
+            filename = f"{stem}_{variant}.webp"
+            tmp_path = os.path.join(output_dir, filename + '.tmp')
+            resized.save(tmp_path, 'WEBP', quality=80, method=4)
+            os.replace(tmp_path, os.path.join(output_dir, filename))
+            variants[variant] = filename
+    return variants
+
+def apply_image_variants(filename, variants):
+    """Record generated variants on the manifest and on every stage using the image"""
+    variant_urls = {variant: asset_url(DERIVED_FOLDER, name) for variant, name in variants.items()}
+    source_url = asset_url('2d', filename)
+    
+    mongo.db.uploaded_assets.update_one(
+        {'type': '2d', 'filename': filename},
+        {'$set': {'variants': variant_urls, 'variants_status': 'ready'}}
+    )
+    result = mongo.db.car_templates.update_many(
+        {'stages.image_url': source_url},
+        {'$set': {'stages.$[stage].image_variants': variant_urls}},
+        array_filters=[{'stage.image_url': source_url}]
+    )
+    if result.modified_count:
+        template_cache.invalidate()
+
+class DerivativeQueue:
+    """Generates image and model variants on a process pool without blocking the upload request"""
+
+    def __init__(self, max_workers):
+        self.max_workers = max_workers
+        self._lock = threading.Lock()
+        self._pool = None
+        self._pool_pid = None
+
+    def _executor(self):
+        # Pools can't be shared across fork, so each worker process gets its own.
+        # Its processes start from a clean interpreter rather than forking a
+        # worker that holds Mongo connections and lock-owning threads
+        with self._lock:
+            if self._pool_pid != os.getpid():
+                method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+                self._pool = ProcessPoolExecutor(max_workers=self.max_workers,
+                                                 mp_context=multiprocessing.get_context(method))
+                self._pool_pid = os.getpid()
+            return self._pool
+
+    def queue(self, filename):
+        stem = filename.rsplit('.', 1)[0]
+        output_dir = os.path.join(app.config['UPLOAD_FOLDER'], DERIVED_FOLDER)
+        existing = {variant: f"{stem}_{variant}.webp" for variant in IMAGE_VARIANTS}
+        
+        # Re-uploads of the same content already have their variants
+        if all(os.path.exists(os.path.join(output_dir, name)) for name in existing.values()):
+            apply_image_variants(filename, existing)
+            return
+        
+        source_path = os.path.join(app.config['UPLOAD_FOLDER'], '2d', filename)
+        self._submit('2d', filename, apply_image_variants, render_image_variants, source_path, output_dir, stem)
+
+    def queue_model(self, filename):
+        """Generate lower-detail versions of a GLB/GLTF model when gltfpack is installed"""
+        stem = filename.rsplit('.', 1)[0]
+        output_dir = os.path.join(app.config['UPLOAD_FOLDER'], DERIVED_FOLDER)
+        existing = {lod: f"{stem}_{lod}.glb" for lod in MODEL_LODS}
+        
+        if all(os.path.exists(os.path.join(output_dir, name)) for name in existing.values()):
+            apply_model_variants(filename, {
+                lod: {'filename': name, **analyze_model(os.path.join(output_dir, name))}
+                for lod, name in existing.items()
+            })
+            return
+        
+        gltfpack = shutil.which(APP_CONFIG['GLTFPACK_PATH'])
+        if not gltfpack:
+            mongo.db.uploaded_assets.update_one(
+                {'type': '3d', 'filename': filename},
+                {'$set': {'variants_status': 'unavailable'}}
+            )
+            return
+        
+        source_path = os.path.join(app.config['UPLOAD_FOLDER'], '3d', filename)
+        self._submit('3d', filename, apply_model_variants, render_model_variants, source_path, output_dir, stem, gltfpack)
+
+    def _submit(self, asset_type, filename, apply, render, *args):
+        mongo.db.uploaded_assets.update_one(
+            {'type': asset_type, 'filename': filename},
+            {'$set': {'variants_status': 'pending'}}
+        )
+        future = self._executor().submit(render, *args)
+        future.add_done_callback(lambda done: self._finished(asset_type, filename, apply, done))
+
+    def _finished(self, asset_type, filename, apply, future):
+        try:
+            apply(filename, future.result())
+        except Exception:
+            app.logger.exception('Generating variants for %s failed', filename)
+            mongo.db.uploaded_assets.update_one(
+                {'type': asset_type, 'filename': filename},
+                {'$set': {'variants_status': 'failed'}}
+            )
+
+image_derivatives = DerivativeQueue(APP_CONFIG['DERIVATIVE_WORKERS'])
+
+@app.template_global()
+def car_stage_image(model_id, progress, variant='card'):
+    """URL of a resized stage image for templates, or '' if none was generated"""
+    stage = template_cache.stage_for_progress(model_id, progress)
+    if not stage:
+        return ''
+    return stage.get('image_variants', {}).get(variant, '')
+
+@app.cli.command('reconcile-assets')
+def reconcile_assets_command():
+    """Sync the uploaded_assets manifest with the files on disk."""
+    added, updated, removed = reconcile_asset_manifest()
+    click.echo(f'Manifest synced: {added} added, {updated} updated, {removed} removed')
+
+# ================== 3D MODEL ANALYSIS ==================
+
+ANALYZED_MODEL_EXTENSIONS = {'glb', 'gltf'}
+GLB_JSON_CHUNK = 0x4E4F534A
+# Analysis runs inside the upload request, so larger JSON (e.g. embedded buffers) isn't parsed
+MAX_GLTF_JSON_BYTES = 2 * 1024 * 1024
+# Level-of-detail variants: share of triangles gltfpack keeps
+MODEL_LODS = {'low': 0.1, 'medium': 0.4}
+GLTFPACK_TIMEOUT = 300
+# glTF primitive modes: 4 = triangles, 5 = strip, 6 = fan
+TRIANGLE_MODES = {4, 5, 6}
+
+class ModelAnalysisError(ValueError):
+    pass
+
+def read_gltf_json(path):
+    """The JSON part of a .gltf file or .glb container; binary buffers aren't read"""
+    with open(path, 'rb') as f:
+        header = f.read(12)
+        if header[:4] == b'glTF':
+            try:
+                _, version, _ = struct.unpack('<4sII', header)
+                if version != 2:
+                    raise ModelAnalysisError(f'Unsupported GLB version {version}')
+                chunk_length, chunk_type = struct.unpack('<II', f.read(8))
+            except struct.error:
+                raise ModelAnalysisError('Truncated GLB header')
+            if chunk_type != GLB_JSON_CHUNK:
+                raise ModelAnalysisError('GLB does not start with a JSON chunk')
+            if chunk_length > MAX_GLTF_JSON_BYTES:
+                raise ModelAnalysisError('glTF JSON is too large to analyze')
+            data = f.read(chunk_length)
+        else:
+            f.seek(0)
+            data = f.read(MAX_GLTF_JSON_BYTES + 1)
+            if len(data) > MAX_GLTF_JSON_BYTES:
+                raise ModelAnalysisError('glTF JSON is too large to analyze')
+    try:
+        return json.loads(data)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise ModelAnalysisError(f'Not a glTF model: {e}')
+
+def analyze_model(path):
+    """Size and complexity of a glTF model.
+
+    Bounds are the union of the POSITION accessor bounds and ignore node
+    transforms, so treat them as approximate.
+    """
+    gltf = read_gltf_json(path)
+    try:
+        return summarize_gltf(gltf, path)
+    except (AttributeError, TypeError, KeyError, IndexError) as e:
+        # Valid JSON, but not shaped like glTF
+        raise ModelAnalysisError(f'Malformed glTF: {e}')
+
+def summarize_gltf(gltf, path):
+    accessors = gltf.get('accessors', [])
+    meshes = gltf.get('meshes', [])
+    primitive_count = vertex_count = triangle_count = 0
+    bounds_min = bounds_max = None
+    
+    for mesh in meshes:
+        for primitive in mesh.get('primitives', []):
+            primitive_count += 1
+            position = primitive.get('attributes', {}).get('POSITION')
+            if position is None or position >= len(accessors):
+                continue
+            positions = accessors[position]
+            vertex_count += positions.get('count', 0)
+            
+            indices = primitive.get('indices')
+            drawn = positions.get('count', 0)
+            if indices is not None and indices < len(accessors):
+                drawn = accessors[indices].get('count', 0)
+            mode = primitive.get('mode', 4)
+            if mode == 4:
+                triangle_count += drawn // 3
+            elif mode in TRIANGLE_MODES:
+                triangle_count += max(drawn - 2, 0)
+            
+            if 'min' in positions and 'max' in positions:
+                if bounds_min is None:
+                    bounds_min, bounds_max = list(positions['min']), list(positions['max'])
+                else:
+                    bounds_min = [min(a, b) for a, b in zip(bounds_min, positions['min'])]
+                    bounds_max = [max(a, b) for a, b in zip(bounds_max, positions['max'])]
+    
+    return {
+        'format': 'glb' if path.lower().endswith('.glb') else 'gltf',
+        'byte_size': os.path.getsize(path),
+        'mesh_count': len(meshes),
+        'primitive_count': primitive_count,
+        'vertex_count': vertex_count,
+        'triangle_count': triangle_count,
+        'material_count': len(gltf.get('materials', [])),
+        'texture_count': len(gltf.get('textures', [])),
+        'image_count': len(gltf.get('images', [])),
+        'bounds': {'min': bounds_min, 'max': bounds_max} if bounds_min else None,
+        'extensions': gltf.get('extensionsUsed', [])
+    }
+
+def render_model_variants(source_path, output_dir, stem, gltfpack):
+    """Simplify a model into every LOD with gltfpack. Runs in a worker process."""
+    os.makedirs(output_dir, exist_ok=True)
+    variants = {}
+    for lod, ratio in MODEL_LODS.items():
+        filename = f"{stem}_{lod}.glb"
+        # gltfpack picks the output format from the extension
+        tmp_path = os.path.join(output_dir, f"{stem}_{lod}.tmp.glb")
+        subprocess.run(
+            [gltfpack, '-i', source_path, '-o', tmp_path, '-si', str(ratio)],
+            check=True, capture_output=True, timeout=GLTFPACK_TIMEOUT
+        )
+        path = os.path.join(output_dir, filename)
+        os.replace(tmp_path, path)
+        variants[lod] = {'filename': filename, **analyze_model(path)}
+    return variants
+
+def apply_model_variants(filename, variants):
+    """Record generated LODs on the manifest and on every stage using the model"""
+    variant_info = {
+        lod: {
+            'url': asset_url(DERIVED_FOLDER, variant['filename']),
+            'byte_size': variant['byte_size'],
+            'vertex_count': variant['vertex_count'],
+            'triangle_count': variant['triangle_count']
+        }
+        for lod, variant in variants.items()
+    }
+    source_url = asset_url('3d', filename)
+    
+    mongo.db.uploaded_assets.update_one(
+        {'type': '3d', 'filename': filename},
+        {'$set': {'variants': variant_info, 'variants_status': 'ready'}}
+    )
+    result = mongo.db.car_templates.update_many(
+        {'stages.model_3d_url': source_url},
+        {'$set': {'stages.$[stage].model_3d_variants': variant_info}},
+        array_filters=[{'stage.model_3d_url': source_url}]
+    )
+    if result.modified_count:
+        template_cache.invalidate()
+
+# ================== SESSION SYNC ==================
+
+SESSION_TOKEN_SALT = 'focus-session'
+# How long a client may hold a finished session before syncing it
+SESSION_TOKEN_MAX_AGE = 7 * 24 * 60 * 60
+MAX_SYNC_SESSIONS = 50
+MAX_IDEMPOTENCY_KEY_LENGTH = 128
+SESSION_TOKEN_FIELDS = ('user_id', 'start_time', 'duration_minutes', 'task_description', 'car_id', 'idempotency_key')
+
+def car_progress_update(progress_increase, minutes_focused, now):
+    """Pipeline crediting focus time to a car: clamp at 100 and mark completion in the same update"""
+    return [
+        {'$set': {
+            'restoration_progress': {'$min': [100, {'$add': ['$restoration_progress', progress_increase]}]},
+            'total_focus_minutes': {'$add': ['$total_focus_minutes', minutes_focused]},
+            'last_session': {'$max': ['$last_session', now]}
+        }},
+        {'$set': {
+            'is_completed': {'$gte': ['$restoration_progress', 100]},
+            'completed_at': {'$ifNull': [
+                '$completed_at',
+                {'$cond': [{'$gte': ['$restoration_progress', 100]}, now, '$$REMOVE']}
+            ]}
+        }}
+    ]
+
+def focus_ledger_key(user_id, started):
+    """focus_sessions key for one started session, taken only from server-issued state"""
+    return f"{user_id}:{started.get('idempotency_key') or started['start_time']}"
+
+def session_running(active_session, now):
+    """Whether a started session could still be in progress: within its duration plus the heartbeat expiry"""
+    started_at = datetime.fromisoformat(active_session['start_time'])
+    ends_at = started_at + timedelta(minutes=active_session.get('duration_minutes') or 0)
+    return now < ends_at + timedelta(seconds=APP_CONFIG['LIVE_SESSION_EXPIRY'])
+
+def abandon_session(user_id, active_session, now):
+    """Close a session that is being replaced, taking its ledger key so its token can't be credited later"""
+    live_sessions.end(user_id)
+    try:
+        mongo.db.focus_sessions.insert_one({
+            'idempotency_key': focus_ledger_key(user_id, active_session),
+            'user_id': user_id,
+            'car_id': active_session.get('car_id'),
+            'task_description': active_session.get('task_description'),
+            'duration_minutes': active_session.get('duration_minutes'),
+            'minutes_focused': 0,
+            'started_at': datetime.fromisoformat(active_session['start_time']),
+            'abandoned': True,
+            'abandoned_at': now
+        })
+    except DuplicateKeyError:
+        pass  # already completed or synced
+
+def valid_idempotency_key(value):
+    return isinstance(value, str) and 0 < len(value) <= MAX_IDEMPOTENCY_KEY_LENGTH
+
+def session_token_serializer():
+    return URLSafeTimedSerializer(app.secret_key, salt=SESSION_TOKEN_SALT)
+
+def issue_session_token(active_session):
+    """Signed copy of the session start, so a client can report the result later without the cookie"""
+    return session_token_serializer().dumps({field: active_session.get(field) for field in SESSION_TOKEN_FIELDS})
+
+def read_session_token(token):
+    try:
+        return session_token_serializer().loads(token, max_age=SESSION_TOKEN_MAX_AGE)
+    except BadSignature:  # includes SignatureExpired
+        return None
+
+def parse_client_time(value, default):
+    """A client ISO 8601 timestamp as naive UTC, or ``default`` when absent"""
+    if not value:
+        return default
+    parsed = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    if parsed.tzinfo:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+def prepare_synced_session(user_id, item, now):
+    """Validate one queued result; returns (ledger document, None) or (None, error)"""
+    if not isinstance(item, dict):
+        return None, 'Invalid session'
+    client_key = item.get('idempotency_key')
+    if not valid_idempotency_key(client_key):
+        return None, 'Missing idempotency_key'
+    
+    started = read_session_token(item.get('session_token') or '')
+    if not started or started.get('user_id') != user_id:
+        return None, 'Invalid or expired session token'
+    # A token credits exactly one session: the one started under this key
+    if started.get('idempotency_key') != client_key:
+        return None, 'Session token does not match idempotency_key'
+    if not started.get('car_id'):
+        return None, 'No car'
+    if not item.get('success'):
+        return None, 'Session failed'
+    
+    try:
+        # Never credit time past the reported end, or past now
+        ended_at = min(parse_client_time(item.get('ended_at'), now), now)
+        minutes_focused = verified_minutes(started, float(item.get('minutes_focused', 0)), ended_at)
+    except (TypeError, ValueError):
+        return None, 'Invalid timestamps or minutes'
+    if minutes_focused < APP_CONFIG['MIN_FOCUS_DURATION']:
+        return None, 'Session too short'
+    
+    return {
+        'idempotency_key': focus_ledger_key(user_id, started),
+        'user_id': user_id,
+        'car_id': started['car_id'],
+        'task_description': started.get('task_description'),
+        'duration_minutes': started.get('duration_minutes'),
+        'minutes_focused': minutes_focused,
+        'scrap_metal_earned': int(minutes_focused),
+        'progress_increase': (minutes_focused / APP_CONFIG['TOTAL_MINUTES_FOR_100_PERCENT']) * 100,
+        'started_at': datetime.fromisoformat(started['start_time']),
+        'completed_at': ended_at,
+        'synced_at': now
+    }, None
+
+def sync_focus_sessions(user_id, items):
+    """Apply queued session results with one bulk_write per collection.
+
+    Each result carries the token from start_session and a client
+    idempotency key. The ledger insert goes first, and its unique key turns
+    retried results into duplicates before anything is credited. Returns
+    one result per item, in order.
+    """
+    now = datetime.utcnow()
+    results = [None] * len(items)
+    ledger = []  # (item index, ledger document)
+    seen_keys = set()
+    for index, item in enumerate(items):
+        document, error = prepare_synced_session(user_id, item, now)
+        if error:
+            results[index] = {'status': 'rejected', 'error': error}
+        elif document['idempotency_key'] in seen_keys:
+            results[index] = {'status': 'duplicate'}
+        else:
+            seen_keys.add(document['idempotency_key'])
+            ledger.append((index, document))
+    
+    # Record the sessions; anything already in the ledger was applied by an earlier request
+    duplicates = set()
+    if ledger:
+        try:
+            mongo.db.focus_sessions.bulk_write([InsertOne(document) for _, document in ledger], ordered=False)
+        except BulkWriteError as e:
+            for error in e.details['writeErrors']:
+                if error['code'] != 11000:
+                    raise
+                duplicates.add(error['index'])
+    for position, (index, _) in enumerate(ledger):
+        if position in duplicates:
+            results[index] = {'status': 'duplicate'}
+    new_sessions = [(index, document) for position, (index, document) in enumerate(ledger) if position not in duplicates]
+    if not new_sessions:
+        return results
+    
+    # Combine the sessions per car, then check the cars belong to this user
+    per_car = {}
+    for index, document in new_sessions:
+        car = per_car.setdefault(document['car_id'], {'progress': 0, 'minutes': 0, 'last': document['completed_at'], 'sessions': []})
+        car['progress'] += document['progress_increase']
+        car['minutes'] += document['minutes_focused']
+        car['last'] = max(car['last'], document['completed_at'])
+        car['sessions'].append((index, document))
+    cars = {
+        str(car['_id']): car
+        for car in mongo.db.user_cars.find(
+            {'_id': {'$in': [ObjectId(car_id) for car_id in per_car if ObjectId.is_valid(car_id)]}, 'user_id': user_id},
+            {'restoration_progress': 1, 'is_completed': 1}
+        )
+    }
+    orphaned = set()
+    for car_id in [car_id for car_id in per_car if car_id not in cars]:
+        for index, document in per_car.pop(car_id)['sessions']:
+            orphaned.add(document['idempotency_key'])
+            results[index] = {'status': 'rejected', 'error': 'Car not found'}
+    if orphaned:
+        mongo.db.focus_sessions.delete_many({'idempotency_key': {'$in': list(orphaned)}})
+        new_sessions = [(index, document) for index, document in new_sessions if document['idempotency_key'] not in orphaned]
+        if not new_sessions:
+            return results
+    
+    mongo.db.user_cars.bulk_write([
+        UpdateOne({'_id': ObjectId(car_id), 'user_id': user_id}, car_progress_update(car['progress'], car['minutes'], car['last']))
+        for car_id, car in per_car.items()
+    ], ordered=False)
+    
+    completed_car_ids = []
+    for car_id, car in per_car.items():
+        new_progress = min(100, cars[car_id]['restoration_progress'] + car['progress'])
+        if new_progress >= 100 and not cars[car_id].get('is_completed'):
+            completed_car_ids.append(car_id)
+        for index, _ in car['sessions']:
+            results[index] = {'status': 'applied', 'car_id': car_id, 'progress': new_progress}
+    
+    # Credit scrap metal and streak days in order, releasing the current car if it was finished
+    user_update = [{'$set': {'scrap_metal': {'$add': [
+        {'$ifNull': ['$scrap_metal', 0]}, sum(document['scrap_metal_earned'] for _, document in new_sessions)
+    ]}}}]
+    for day in sorted({period_start('day', document['completed_at']) for _, document in new_sessions}):
+        user_update += streak_update(day)
+    if completed_car_ids:
+        user_update.append({'$set': {'current_car_id': {
+            '$cond': [{'$in': ['$current_car_id', completed_car_ids]}, '$$REMOVE', '$current_car_id']
+        }}})
+    user = mongo.db.users.find_one_and_update({'_id': ObjectId(user_id)}, user_update, projection={'username': 1})
+    
+    rollup_buffer.record(
+        user_id, user.get('username') if user else None,
+        [(document['minutes_focused'], document['completed_at']) for _, document in new_sessions]
+    )
+    
+    stat_deltas = {'total_focus_minutes': sum(document['minutes_focused'] for _, document in new_sessions)}
+    if completed_car_ids:
+        stat_deltas['completed_cars'] = len(completed_car_ids)
+    dashboard_stats.increment(**stat_deltas)
+    return results
+
+# ================== GARAGE PAGE ==================
+
+SHOWROOM_PAGE_SIZE = 12
+MAX_SHOWROOM_PAGE_SIZE = 50
+SHOWROOM_SORT = [('completed_at', DESCENDING), ('_id', DESCENDING)]
+GARAGE_USER_FIELDS = {'username': 1, 'scrap_metal': 1, 'blueprints': 1, 'current_car_id': 1}
+GARAGE_CAR_FIELDS = ('car_model', 'restoration_progress', 'total_focus_minutes', 'is_completed', 'completed_at')
+SHOWROOM_CAR_FIELDS = {'car_model': 1, 'total_focus_minutes': 1, 'completed_at': 1}
+
+def showroom_filter(user_id, cursor=None):
+    """Completed cars for a user, after ``cursor`` in (completed_at, _id) descending order"""
+    query = {'user_id': user_id, 'is_completed': True}
+    if not cursor:
+        return query
+    completed_at, car_id = cursor
+    # Cars finished before completed_at was recorded sort last, ordered by _id
+    if completed_at is None:
+        query.update({'completed_at': None, '_id': {'$lt': car_id}})
+    else:
+        query['$or'] = [
+            {'completed_at': {'$lt': completed_at}},
+            {'completed_at': completed_at, '_id': {'$lt': car_id}},
+            {'completed_at': None}
+        ]
+    return query
+
+def showroom_cursor(car):
+    completed_at = car.get('completed_at')
+    return f"{completed_at.isoformat() if completed_at else ''}_{car['_id']}"
+
+def parse_showroom_cursor(value):
+    completed_at, _, car_id = value.rpartition('_')
+    if not ObjectId.is_valid(car_id):
+        raise ValueError('Invalid cursor')
+    return (datetime.fromisoformat(completed_at) if completed_at else None), ObjectId(car_id)
+
+def showroom_page(cars, page_size):
+    """Split a page fetched with one extra car into (cars, next cursor)"""
+    if len(cars) > page_size:
+        cars = cars[:page_size]
+        return cars, showroom_cursor(cars[-1])
+    return cars, None
+
+def showroom_entry(car):
+    """A completed car as the showroom list renders it"""
+    return {
+        'car_model': car['car_model'],
+        'name': car['car_model'].replace('_', ' ').title(),
+        'completed_at': car['completed_at'].strftime('%b %d') if car.get('completed_at') else None,
+        'hours': round(car.get('total_focus_minutes', 0) / 60, 1),
+        'thumb_url': car_stage_image(car['car_model'], 100, 'thumb')
+    }
+
+def garage_panels(scrap_metal, car):
+    """State of the garage page's panels, so it can be updated in place instead of re-rendered"""
+    panels = {'scrap_metal': scrap_metal, 'car': None}
+    if not car:
+        return panels
+    
+    progress = car.get('restoration_progress', 0)
+    template = template_cache.get(car['car_model']) or {}
+    next_stage = next((stage for stage in template.get('stages', []) if stage.get('threshold', 0) > progress), None)
+    panels['car'] = {
+        'car_id': str(car['_id']),
+        'car_model': car['car_model'],
+        'name': template.get('name', car['car_model'].replace('_', ' ').title()),
+        'progress': progress,
+        'hours_focused': round(car.get('total_focus_minutes', 0) / 60, 1),
+        'is_completed': progress >= 100,
+        'next_milestone': next_stage.get('description', '') if next_stage else 'Showroom Ready!',
+        'image_url': car_stage_image(car['car_model'], progress, 'full'),
+        'stage': stage_payload(car['car_model'], progress)
+    }
+    return panels
+
+def load_garage(user_id):
+    """The user, their current car and the first showroom page in one aggregation"""
+    # _id is only kept automatically at the top level, so ask for the car's explicitly
+    car_projection = {f'current_car.{field}': 1 for field in ('_id',) + GARAGE_CAR_FIELDS}
+    results = list(mongo.db.users.aggregate([
+        {'$match': {'_id': ObjectId(user_id)}},
+        # current_car_id is stored as a string; convert it so the lookup hits user_cars._id
+        {'$project': {**GARAGE_USER_FIELDS, 'current_car_oid': {'$toObjectId': '$current_car_id'}}},
+        {'$lookup': {
+            'from': 'user_cars',
+            'localField': 'current_car_oid',
+            'foreignField': '_id',
+            'as': 'current_car'
+        }},
+        {'$lookup': {
+            'from': 'user_cars',
+            'pipeline': [
+                {'$match': showroom_filter(user_id)},
+                {'$sort': dict(SHOWROOM_SORT)},
+                {'$limit': SHOWROOM_PAGE_SIZE + 1},
+                {'$project': SHOWROOM_CAR_FIELDS}
+            ],
+            'as': 'completed_cars'
+        }},
+        {'$project': {**GARAGE_USER_FIELDS, **car_projection, 'completed_cars': 1}}
+    ]))
+    if not results:
+        return None
+    
+    user = results[0]
+    user['current_car'] = user['current_car'][0] if user['current_car'] else None
+    return user
+
+# ================== DATABASE INDEXES ==================
+
+# (collection, keys, options) for every index the app's queries rely on
+INDEXES = [
+    ('users', [('username', ASCENDING)], {'unique': True}),
+    ('users', [('created_at', DESCENDING)], {}),
+    ('user_cars', [('user_id', ASCENDING), ('is_completed', ASCENDING), ('completed_at', DESCENDING), ('_id', DESCENDING)], {}),
+    ('user_cars', [('created_at', DESCENDING)], {}),
+    ('user_cars', [('last_session', ASCENDING)], {}),
+    ('car_templates', [('model_id', ASCENDING)], {'unique': True}),
+    ('car_templates', [('stages.threshold', ASCENDING)], {}),
+    ('focus_sessions', [('idempotency_key', ASCENDING)], {'unique': True}),
+    ('focus_sessions', [('user_id', ASCENDING), ('completed_at', DESCENDING)], {}),
+    ('focus_sessions', [('completed_at', ASCENDING)], {}),
+    ('live_sessions', [('last_heartbeat', ASCENDING)], {'expireAfterSeconds': APP_CONFIG['LIVE_SESSION_EXPIRY']}),
+    ('sessions', [('expires_at', ASCENDING)], {'expireAfterSeconds': 0}),
+    ('uploaded_assets', [('type', ASCENDING), ('filename', ASCENDING)], {'unique': True}),
+    ('uploaded_assets', [('uploaded_at', DESCENDING)], {}),
+    ('uploaded_assets', [('type', ASCENDING), ('uploaded_at', DESCENDING)], {}),
+    ('uploaded_assets', [('car_id', ASCENDING), ('uploaded_at', DESCENDING)], {}),
+    ('focus_rollups', [('user_id', ASCENDING), ('period', ASCENDING), ('start', DESCENDING)], {}),
+    ('focus_rollups', [('period', ASCENDING), ('start', ASCENDING), ('minutes', DESCENDING)], {}),
+]
+
+# (description, collection, filter, sort) for the queries the routes issue
+AUDITED_QUERIES = [
+    ('login/register: user by username', 'users', {'username': 'audit'}, None),
+    ('index: user by id', 'users', {'_id': ObjectId()}, None),
+    ('index: current car by id', 'user_cars', {'_id': ObjectId()}, None),
+    ('index: completed cars for user', 'user_cars', {'user_id': 'audit', 'is_completed': True}, SHOWROOM_SORT),
+    ('admin_dashboard: recent users', 'users', {}, [('created_at', DESCENDING)]),
+    ('admin_dashboard: recent cars', 'user_cars', {}, [('created_at', DESCENDING)]),
+    ('car_3d: template by model_id', 'car_templates', {'model_id': 'audit'}, None),
+    ('admin_upload: template stage', 'car_templates', {'stages.threshold': 0}, None),
+    ('admin_upload: assets by type', 'uploaded_assets', {'type': '2d'}, [('uploaded_at', DESCENDING)]),
+    ('focus_history: buckets for user', 'focus_rollups', {'user_id': 'audit', 'period': 'day'}, [('start', DESCENDING)]),
+    ('leaderboard: top users', 'focus_rollups', {'period': 'all', 'start': None}, [('minutes', DESCENDING)]),
+]
+
+def init_indexes():
+    """Create the indexes the app relies on. Safe to run on every start."""
+    for collection, keys, options in INDEXES:
+        try:
+            mongo.db[collection].create_index(keys, **options)
+        except OperationFailure as e:
+            # A changed TTL can be applied in place; anything else is a real conflict
+            if e.code != 85 or 'expireAfterSeconds' not in options:
+                raise
+            mongo.db.command('collMod', collection, index={
+                'keyPattern': dict(keys),
+                'expireAfterSeconds': options['expireAfterSeconds']
+            })
+
+def _plan_stages(plan):
+    """Yield every stage name in an explain() plan tree"""
+    if isinstance(plan, dict):
+        if 'stage' in plan:
+            yield plan['stage']
+        for value in plan.values():
+            yield from _plan_stages(value)
+    elif isinstance(plan, list):
+        for item in plan:
+            yield from _plan_stages(item)
+
+@app.cli.command('init-indexes')
+def init_indexes_command():
+    """Create all MongoDB indexes."""
+    init_indexes()
+    click.echo(f'Ensured {len(INDEXES)} indexes')
+
+@app.cli.command('audit-queries')
+def audit_queries_command():
+    """Explain the app's queries and fail if any scans a collection."""
+    scans = 0
+    for description, collection, query, sort in AUDITED_QUERIES:
+        cursor = mongo.db[collection].find(query).limit(5)
+        if sort:
+            cursor = cursor.sort(sort)
+        winning_plan = cursor.explain()['queryPlanner']['winningPlan']
+        stages = list(_plan_stages(winning_plan))
+        status = 'COLLSCAN' if 'COLLSCAN' in stages else 'ok'
+        if status == 'COLLSCAN':
+            scans += 1
+        click.echo(f'[{status}] {description}: {" <- ".join(stages)}')
+
+    if scans:
+        click.echo(f'{scans} of {len(AUDITED_QUERIES)} queries scan a collection', err=True)
+        raise SystemExit(1)
+    click.echo(f'All {len(AUDITED_QUERIES)} queries use an index')
 
 @app.route('/')
 def index():
     if 'user_id' not in session:
         return redirect(url_for('login'))
     
-    user = mongo.db.users.find_one({'_id': ObjectId(session['user_id'])})
+    user = load_garage(session['user_id'])
     if not user:
         return redirect(url_for('login'))
     
     # Get current car
-    current_car = None
-    if user.get('current_car_id'):
-        current_car = mongo.db.user_cars.find_one({'_id': ObjectId(user['current_car_id'])})
-        if current_car:
-            car_template = mongo.db.car_templates.find_one({'model_id': current_car['car_model']})
-            current_car['template'] = car_template
+    current_car = user.pop('current_car')
+    if current_car:
+        current_car['template'] = template_cache.get(current_car['car_model'])
     
-    # Get completed cars for showroom
-    completed_cars = list(mongo.db.user_cars.find({
-        'user_id': session['user_id'], 
-        'is_completed': True
-    }))
+    # First page of the showroom; the page fetches the rest from /api/showroom
+    completed_cars, showroom_next = showroom_page(user.pop('completed_cars'), SHOWROOM_PAGE_SIZE)
     
     return render_template('garage.html', 
                          user=user, 
                          current_car=current_car, 
-                         completed_cars=completed_cars)
+                         completed_cars=completed_cars,
+                         showroom_next=showroom_next)
+
+@app.route('/api/showroom')
+def showroom():
+    """Next page of completed cars, newest first"""
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'error': 'Not authenticated'})
+    
+    limit = min(max(request.args.get('limit', SHOWROOM_PAGE_SIZE, type=int), 1), MAX_SHOWROOM_PAGE_SIZE)
+    cursor = None
+    if request.args.get('after'):
+        try:
+            cursor = parse_showroom_cursor(request.args['after'])
+        except ValueError:
+            return jsonify({'success': False, 'error': 'Invalid cursor'}), 400
+    
+    cars = list(mongo.db.user_cars.find(
+        showroom_filter(session['user_id'], cursor), SHOWROOM_CAR_FIELDS
+    ).sort(SHOWROOM_SORT).limit(limit + 1))
+    cars, next_cursor = showroom_page(cars, limit)
+    
+    return jsonify({
+        'success': True,
+        'cars': [showroom_entry(car) for car in cars],
+        'next': next_cursor
+    })
+
+@app.route('/api/garage/panels')
+def garage_panels_api():
+    """Current car progress, stage and balance for refreshing the garage page in place"""
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'error': 'Not authenticated'})
+    
+    user = mongo.db.users.find_one({'_id': ObjectId(session['user_id'])}, {'scrap_metal': 1, 'current_car_id': 1})
+    if not user:
+        return jsonify({'success': False, 'error': 'User not found'})
+    
+    car = None
+    if user.get('current_car_id'):
+        car = mongo.db.user_cars.find_one(
+            {'_id': ObjectId(user['current_car_id']), 'user_id': session['user_id']},
+            {field: 1 for field in GARAGE_CAR_FIELDS}
+        )
+    return jsonify({'success': True, **garage_panels(user.get('scrap_metal', 0), car)})
 
 @app.route('/login', methods=['GET', 'POST'])
 def login():
@@ -112,8 +2132,15 @@ def login():
         username = request.form['username']
         password = request.form['password']
         
-        user = mongo.db.users.find_one({'username': username})
-        if user and check_password_hash(user['password'], password):
+        user = mongo.db.users.find_one({'username': username}, {'password': 1})
+        try:
+            valid = user is not None and password_hasher.verify(username, user['password'], password)
+        except HashingBusy as e:
+            return hashing_busy_response('login.html', e)
+        
+        if valid:
+            password_hasher.upgrade(user['_id'], user['password'], password)
+            session.regenerate()
             session['user_id'] = str(user['_id'])
             return redirect(url_for('index'))
         else:
@@ -134,16 +2161,26 @@ def register():
         if mongo.db.users.find_one({'username': username}):
             return render_template('register.html', error='Username already exists')
         
-        # Create new user
-        user_id = mongo.db.users.insert_one({
-            'username': username,
-            'password': generate_password_hash(password),
-            'scrap_metal': 0,
-            'blueprints': 0,
-            'current_car_id': None,
-            'created_at': datetime.utcnow()
-        }).inserted_id
+        try:
+            password_hash = password_hasher.hash(password)
+        except HashingBusy as e:
+            return hashing_busy_response('register.html', e)
+        
+        # Create new user (the unique index catches concurrent registrations)
+        try:
+            user_id = mongo.db.users.insert_one({
+                'username': username,
+                'password': password_hash,
+                'scrap_metal': 0,
+                'blueprints': 0,
+                'current_car_id': None,
+                'created_at': datetime.utcnow()
+            }).inserted_id
+        except DuplicateKeyError:
+            return render_template('register.html', error='Username already exists')
+        dashboard_stats.increment(total_users=1)
         
+        session.regenerate()
         session['user_id'] = str(user_id)
         return redirect(url_for('junkyard'))
     
@@ -160,7 +2197,7 @@ def junkyard():
         return redirect(url_for('login'))
     
     # Get available car templates
-    car_templates = list(mongo.db.car_templates.find({}))
+    car_templates = template_cache.all()
     return render_template('junkyard.html', car_templates=car_templates)
 
 @app.route('/api/select_car', methods=['POST'])
@@ -181,6 +2218,7 @@ def select_car():
         'is_completed': False,
         'created_at': datetime.utcnow()
     }).inserted_id
+    dashboard_stats.increment(total_cars=1)
     
     # Update user's current car
     mongo.db.users.update_one(
@@ -198,16 +2236,49 @@ def start_session():
     data = request.get_json()
     duration_minutes = int(data.get('duration', 25))
     task_description = data.get('task', 'Focus Session')
+    now = datetime.utcnow()
+    
+    # One focus session at a time; replacing a running one has to be asked for
+    previous = session.get('active_session')
+    if previous:
+        if session_running(previous, now) and not data.get('replace'):
+            return jsonify({
+                'success': False,
+                'error': 'A focus session is already running',
+                'started_at': previous['start_time'],
+                'duration_minutes': previous.get('duration_minutes')
+            }), 409
+        abandon_session(session['user_id'], previous, now)
+    
+    # Pin the car being worked on so completion doesn't need to look it up
+    user = mongo.db.users.find_one(
+        {'_id': ObjectId(session['user_id'])},
+        {'current_car_id': 1}
+    )
+    
+    # Every session gets a key, so its token and its ledger entry name the same session
+    idempotency_key = data.get('idempotency_key')
+    if not valid_idempotency_key(idempotency_key):
+        idempotency_key = secrets.token_urlsafe(16)
     
     # Store session data in user session
     session['active_session'] = {
-        'start_time': datetime.utcnow().isoformat(),
+        'start_time': now.isoformat(),
         'duration_minutes': duration_minutes,
         'task_description': task_description,
-        'user_id': session['user_id']
+        'user_id': session['user_id'],
+        'car_id': user.get('current_car_id') if user else None,
+        # Lets a result synced later via /api/sync_sessions match this session
+        'idempotency_key': idempotency_key
     }
+    live_sessions.start(session['user_id'], session['active_session'], data.get('mode'))
     
-    return jsonify({'success': True, 'session_id': session['user_id']})
+    return jsonify({
+        'success': True,
+        'session_id': session['user_id'],
+        'idempotency_key': idempotency_key,
+        'session_token': issue_session_token(session['active_session'])
+    })
 
 @app.route('/api/complete_session', methods=['POST'])
 def complete_session():
@@ -215,67 +2286,108 @@ def complete_session():
         return jsonify({'success': False, 'error': 'No active session'})
     
     data = request.get_json()
-    minutes_focused = float(data.get('minutes_focused', 0))
+    active_session = session['active_session']
+    user_id = session['user_id']
+    now = datetime.utcnow()
+    
+    # Never credit more time than has actually passed since start_session
+    minutes_focused = verified_minutes(active_session, client_minutes(data.get('minutes_focused')), now)
     was_successful = data.get('success', False)
+    live_sessions.end(user_id)
     
-    if not was_successful or minutes_focused < 5:  # Minimum 5 minutes for progress
+    if not was_successful or minutes_focused < APP_CONFIG['MIN_FOCUS_DURATION']:
+        # Take the session's ledger key so its token can't be synced as a success later
+        abandon_session(user_id, active_session, now)
         session.pop('active_session', None)
         return jsonify({'success': False, 'message': 'Session failed - dropped the wrench!'})
     
-    # Get user and current car
-    user = mongo.db.users.find_one({'_id': ObjectId(session['user_id'])})
-    if not user or not user.get('current_car_id'):
+    # Sessions started before car pinning fall back to the user's current car
+    car_id = active_session.get('car_id')
+    if not car_id:
+        user = mongo.db.users.find_one({'_id': ObjectId(user_id)}, {'current_car_id': 1})
+        car_id = user.get('current_car_id') if user else None
+    if not car_id:
         return jsonify({'success': False, 'error': 'No current car'})
     
-    current_car = mongo.db.user_cars.find_one({'_id': ObjectId(user['current_car_id'])})
-    if not current_car:
-        return jsonify({'success': False, 'error': 'Car not found'})
-    
     # Calculate progress and rewards
     scrap_metal_earned = int(minutes_focused)  # 1 minute = 1 scrap metal
-    progress_increase = (minutes_focused / 300) * 100  # 300 minutes = 100%
+    progress_increase = (minutes_focused / APP_CONFIG['TOTAL_MINUTES_FOR_100_PERCENT']) * 100
     
-    new_progress = min(100, current_car['restoration_progress'] + progress_increase)
-    new_total_minutes = current_car['total_focus_minutes'] + minutes_focused
-    
-    # Update car progress
-    updates = {
-        'restoration_progress': new_progress,
-        'total_focus_minutes': new_total_minutes,
-        'last_session': datetime.utcnow()
-    }
+    # Record the session first; the unique key makes retries a no-op. It comes
+    # only from the state stored at start, so a replayed request can't pick a new one
+    idempotency_key = focus_ledger_key(user_id, active_session)
+    try:
+        ledger_id = mongo.db.focus_sessions.insert_one({
+            'idempotency_key': idempotency_key,
+            'user_id': user_id,
+            'car_id': car_id,
+            'task_description': active_session.get('task_description'),
+            'duration_minutes': active_session.get('duration_minutes'),
+            'minutes_focused': minutes_focused,
+            'scrap_metal_earned': scrap_metal_earned,
+            'progress_increase': progress_increase,
+            'started_at': datetime.fromisoformat(active_session['start_time']),
+            'completed_at': now
+        }).inserted_id
+    except DuplicateKeyError:
+        session.pop('active_session', None)
+        return jsonify({'success': True, 'duplicate': True, 'message': 'Session already recorded'})
     
-    # Check if car is completed
-    if new_progress >= 100:
-        updates['is_completed'] = True
-        updates['completed_at'] = datetime.utcnow()
-        
-        # Clear user's current car so they can pick a new one
-        mongo.db.users.update_one(
-            {'_id': ObjectId(session['user_id'])},
-            {'$unset': {'current_car_id': ''}}
+    # Apply progress atomically: clamp at 100 and mark completion in the same update
+    try:
+        previous = mongo.db.user_cars.find_one_and_update(
+            {'_id': ObjectId(car_id), 'user_id': user_id},
+            car_progress_update(progress_increase, minutes_focused, now),
+            projection={field: 1 for field in GARAGE_CAR_FIELDS},
+            return_document=ReturnDocument.BEFORE
         )
+    except Exception:
+        # Free the key so the client's retry can apply the session
+        mongo.db.focus_sessions.delete_one({'_id': ledger_id})
+        raise
+    if not previous:
+        mongo.db.focus_sessions.delete_one({'_id': ledger_id})
+        return jsonify({'success': False, 'error': 'Car not found'})
     
-    # Update car
-    mongo.db.user_cars.update_one(
-        {'_id': ObjectId(user['current_car_id'])},
-        {'$set': updates}
-    )
+    # The pre-image tells us exactly what this update changed
+    new_progress = min(100, previous['restoration_progress'] + progress_increase)
+    newly_completed = new_progress >= 100 and not previous.get('is_completed')
     
-    # Update user's currency
-    mongo.db.users.update_one(
-        {'_id': ObjectId(session['user_id'])},
-        {'$inc': {'scrap_metal': scrap_metal_earned}}
-    )
+    # Update user's currency and streak, clearing the current car once this session finishes it
+    user_update = [{'$set': {'scrap_metal': {'$add': [{'$ifNull': ['$scrap_metal', 0]}, scrap_metal_earned]}}}]
+    user_update += streak_update(period_start('day', now))
+    if newly_completed:
+        # Only if it is still current; the user may have moved on to another car mid-session
+        user_update.append({'$set': {'current_car_id': {
+            '$cond': [{'$eq': ['$current_car_id', car_id]}, '$$REMOVE', '$current_car_id']
+        }}})
+    user = mongo.db.users.find_one_and_update(
+        {'_id': ObjectId(user_id)}, user_update,
+        projection={'username': 1, 'scrap_metal': 1},
+        return_document=ReturnDocument.AFTER
+    ) or {}
+    rollup_buffer.record(user_id, user.get('username'), [(minutes_focused, now)])
+    
+    stat_deltas = {'total_focus_minutes': minutes_focused}
+    if newly_completed:
+        stat_deltas['completed_cars'] = 1
+    dashboard_stats.increment(**stat_deltas)
     
     # Clear session
     session.pop('active_session', None)
     
+    # The car as this update left it, so the page can update without a reload
+    car = dict(previous,
+               restoration_progress=new_progress,
+               total_focus_minutes=previous.get('total_focus_minutes', 0) + minutes_focused,
+               is_completed=new_progress >= 100)
+    
     return jsonify({
         'success': True,
         'progress': new_progress,
         'scrap_metal_earned': scrap_metal_earned,
         'car_completed': new_progress >= 100,
+        'garage': garage_panels(user.get('scrap_metal', 0), car),
         'message': f'Great work! Earned {scrap_metal_earned} scrap metal!'
     })
 
@@ -285,8 +2397,122 @@ def heartbeat():
     if 'user_id' not in session or 'active_session' not in session:
         return jsonify({'success': False, 'error': 'No active session'})
     
+    data = request.get_json(silent=True) or {}
+    elapsed_minutes = client_minutes(data.get('elapsed_minutes'))
+    live_sessions.heartbeat(session['user_id'], session['active_session'], elapsed_minutes, data.get('mode'))
+    
     return jsonify({'success': True, 'message': 'Session active'})
 
+@app.route('/api/sync_sessions', methods=['POST'])
+def sync_sessions():
+    """Apply session results queued by offline or background clients; safe to retry"""
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'error': 'Not authenticated'})
+    
+    data = request.get_json(silent=True) or {}
+    items = data.get('sessions')
+    if not isinstance(items, list) or not items:
+        return jsonify({'success': False, 'error': 'No sessions to sync'}), 400
+    if len(items) > MAX_SYNC_SESSIONS:
+        return jsonify({'success': False, 'error': f'At most {MAX_SYNC_SESSIONS} sessions per request'}), 400
+    
+    results = sync_focus_sessions(session['user_id'], items)
+    
+    # A synced session may be the one this browser still has open
+    active_session = session.get('active_session')
+    if active_session:
+        synced_keys = {item.get('idempotency_key') for item in items if isinstance(item, dict)}
+        if active_session.get('idempotency_key') in synced_keys:
+            session.pop('active_session', None)
+            live_sessions.end(session['user_id'])
+    
+    for item, result in zip(items, results):
+        result['idempotency_key'] = item.get('idempotency_key') if isinstance(item, dict) else None
+    
+    return jsonify({
+        'success': True,
+        'results': results,
+        'applied': sum(1 for result in results if result['status'] == 'applied'),
+        'duplicates': sum(1 for result in results if result['status'] == 'duplicate')
+    })
+
+@app.route('/api/focus/streak')
+def focus_streak():
+    """Current and longest run of consecutive focus days"""
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'error': 'Not authenticated'})
+    
+    user = mongo.db.users.find_one(
+        {'_id': ObjectId(session['user_id'])},
+        {'focus_streak': 1, 'longest_focus_streak': 1, 'last_focus_day': 1}
+    ) or {}
+    last_day = user.get('last_focus_day')
+    return jsonify({
+        'success': True,
+        'current': current_streak(user),
+        'longest': user.get('longest_focus_streak', 0),
+        'last_focus_day': last_day.strftime('%Y-%m-%d') if last_day else None
+    })
+
+@app.route('/api/focus/history')
+def focus_history():
+    """Focus minutes per day or week, newest first"""
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'error': 'Not authenticated'})
+    
+    period = request.args.get('period', 'day')
+    if period not in ('day', 'week'):
+        return jsonify({'success': False, 'error': 'period must be day or week'}), 400
+    limit = min(max(request.args.get('limit', 30, type=int), 1), MAX_HISTORY_BUCKETS)
+    
+    rollup_buffer.flush()
+    buckets = mongo.db.focus_rollups.find(
+        {'user_id': session['user_id'], 'period': period},
+        {'_id': 0, 'start': 1, 'minutes': 1, 'sessions': 1}
+    ).sort('start', DESCENDING).limit(limit)
+    
+    return jsonify({
+        'success': True,
+        'period': period,
+        'history': [{
+            'start': bucket['start'].strftime('%Y-%m-%d'),
+            'minutes': bucket['minutes'],
+            'sessions': bucket['sessions']
+        } for bucket in buckets]
+    })
+
+@app.route('/api/leaderboard')
+def leaderboard():
+    """Top users by focus minutes today, this week or all time"""
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'error': 'Not authenticated'})
+    
+    period = request.args.get('period', 'week')
+    if period not in ROLLUP_PERIODS:
+        return jsonify({'success': False, 'error': 'period must be day, week or all'}), 400
+    limit = min(max(request.args.get('limit', 10, type=int), 1), MAX_LEADERBOARD_SIZE)
+    start = period_start(period, datetime.utcnow())
+    
+    # Walks the (period, start, minutes) index, so this reads `limit` documents
+    rollup_buffer.flush()
+    entries = mongo.db.focus_rollups.find(
+        {'period': period, 'start': start},
+        {'_id': 0, 'user_id': 1, 'username': 1, 'minutes': 1, 'sessions': 1}
+    ).sort('minutes', DESCENDING).limit(limit)
+    
+    return jsonify({
+        'success': True,
+        'period': period,
+        'start': start.strftime('%Y-%m-%d') if start else None,
+        'leaderboard': [{
+            'rank': rank,
+            'username': entry.get('username'),
+            'minutes': entry['minutes'],
+            'sessions': entry['sessions'],
+            'is_you': entry['user_id'] == session['user_id']
+        } for rank, entry in enumerate(entries, 1)]
+    })
+
 # ================== ADMIN DASHBOARD ROUTES ==================
 
 @app.route('/admin/login', methods=['GET', 'POST'])
@@ -296,6 +2522,7 @@ def admin_login():
         password = request.form['password']
         
         if username == APP_CONFIG['ADMIN_USERNAME'] and password == APP_CONFIG['ADMIN_PASSWORD']:
+            session.regenerate()
             session['is_admin'] = True
             session['admin_user'] = username
             flash('Admin login successful', 'success')
@@ -319,23 +2546,11 @@ def admin_dashboard():
         return redirect(url_for('admin_login'))
     
     # Get statistics
-    stats = {
-        'total_users': mongo.db.users.count_documents({}),
-        'total_cars': mongo.db.user_cars.count_documents({}),
-        'completed_cars': mongo.db.user_cars.count_documents({'is_completed': True}),
-        'car_templates': mongo.db.car_templates.count_documents({}),
-        'total_focus_time': list(mongo.db.user_cars.aggregate([
-            {'$group': {'_id': None, 'total': {'$sum': '$total_focus_minutes'}}}
-        ]))
-    }
-    
-    if stats['total_focus_time']:
-        stats['total_focus_hours'] = round(stats['total_focus_time'][0]['total'] / 60, 2)
-    else:
-        stats['total_focus_hours'] = 0
+    stats = dashboard_stats.get()
+    stats['total_focus_hours'] = round(stats['total_focus_minutes'] / 60, 2)
     
     # Get recent activity
-    recent_users = list(mongo.db.users.find().sort('created_at', -1).limit(5))
+    recent_users = list(mongo.db.users.find({}, {'password': 0}).sort('created_at', -1).limit(5))
     recent_cars = list(mongo.db.user_cars.find().sort('created_at', -1).limit(5))
     
     return render_template('admin/dashboard.html', 
@@ -383,7 +2598,13 @@ def admin_new_car():
             'created_by': session['admin_user']
         }
         
-        result = mongo.db.car_templates.insert_one(new_car)
+        try:
+            result = mongo.db.car_templates.insert_one(new_car)
+        except DuplicateKeyError:
+            flash('Model ID already exists', 'error')
+            return render_template('admin/car_form.html')
+        template_cache.invalidate()
+        dashboard_stats.increment(car_templates=1)
         flash(f'Car template "{name}" created successfully', 'success')
         return redirect(url_for('admin_edit_car', car_id=str(result.inserted_id)))
     
@@ -408,6 +2629,8 @@ def admin_delete_car(car_id):
     
     result = mongo.db.car_templates.delete_one({'_id': ObjectId(car_id)})
     if result.deleted_count > 0:
+        template_cache.invalidate()
+        dashboard_stats.increment(car_templates=-1)
         flash('Car template deleted successfully', 'success')
     else:
         flash('Car template not found', 'error')
@@ -427,6 +2650,8 @@ def admin_upload():
         
         file = request.files['file']
         asset_type = request.form.get('asset_type', '2d')  # '2d' or '3d'
+        if asset_type not in ASSET_TYPES:
+            asset_type = '2d'
         car_id = request.form.get('car_id')
         stage_threshold = request.form.get('stage_threshold', '0')
         
@@ -435,39 +2660,61 @@ def admin_upload():
             return redirect(request.url)
         
         if file and allowed_file(file.filename):
-            # Generate unique filename
-            filename = secure_filename(file.filename)
-            unique_filename = f"{uuid.uuid4()}_{filename}"
-            
-            # Create directory structure
-            if asset_type == '3d':
-                upload_path = os.path.join(app.config['UPLOAD_FOLDER'], '3d')
-            else:
-                upload_path = os.path.join(app.config['UPLOAD_FOLDER'], '2d')
-            
-            os.makedirs(upload_path, exist_ok=True)
-            file_path = os.path.join(upload_path, unique_filename)
+            if file.stream.size > upload_limit(asset_type):
+                flash(f'File too large for {asset_type.upper()} assets (max {upload_limit(asset_type) // (1024 * 1024)}MB)', 'error')
+                return redirect(request.url)
             
             try:
-                file.save(file_path)
+                unique_filename, size, already_stored = store_upload(file, asset_type)
+                linked_car_id = None
+                linked_threshold = None
+                
+                # Read size and complexity from glTF models so the viewer can pick a LOD
+                model_meta = None
+                analyzable = unique_filename.rsplit('.', 1)[-1] in ANALYZED_MODEL_EXTENSIONS
+                if asset_type == '3d' and analyzable:
+                    try:
+                        model_meta = analyze_model(os.path.join(app.config['UPLOAD_FOLDER'], '3d', unique_filename))
+                    except ModelAnalysisError as e:
+                        flash(f'Could not analyze model: {e}', 'error')
                 
                 # Update car template if specified
                 if car_id and car_id != '':
                     stage_threshold = int(stage_threshold)
                     update_field = 'model_3d_url' if asset_type == '3d' else 'image_url'
-                    file_url = f"/static/assets/uploads/{asset_type}/{unique_filename}"
+                    file_url = asset_url(asset_type, unique_filename)
+                    stage_update = {'$set': {f'stages.$.{update_field}': file_url}}
+                    if asset_type == '2d':
+                        # Variants of the previous image no longer apply; queue() adds the new ones
+                        stage_update['$unset'] = {'stages.$.image_variants': ''}
+                    else:
+                        # LODs of the previous model no longer apply; queue_model adds the new ones
+                        stage_update['$unset'] = {'stages.$.model_3d_variants': ''}
+                        if model_meta:
+                            stage_update['$set']['stages.$.model_3d_meta'] = model_meta
+                        else:
+                            stage_update['$unset']['stages.$.model_3d_meta'] = ''
                     
                     mongo.db.car_templates.update_one(
                         {
                             '_id': ObjectId(car_id),
                             'stages.threshold': stage_threshold
                         },
-                        {
-                            '$set': {f'stages.$.{update_field}': file_url}
-                        }
+                        stage_update
                     )
+                    template_cache.invalidate()
+                    linked_car_id = car_id
+                    linked_threshold = stage_threshold
                 
-                flash(f'File uploaded successfully: {unique_filename}', 'success')
+                record_asset(asset_type, unique_filename, size, linked_car_id, linked_threshold, metadata=model_meta)
+                if asset_type == '2d':
+                    image_derivatives.queue(unique_filename)
+                elif model_meta:
+                    image_derivatives.queue_model(unique_filename)
+                if already_stored:
+                    flash(f'File already uploaded, reusing: {unique_filename}', 'success')
+                else:
+                    flash(f'File uploaded successfully: {unique_filename}', 'success')
                 
             except Exception as e:
                 flash(f'Error saving file: {str(e)}', 'error')
@@ -476,24 +2723,107 @@ def admin_upload():
     
     # Get car templates for dropdown
     car_templates = list(mongo.db.car_templates.find())
-    uploaded_files = []
     
-    # Get existing uploaded files
-    for asset_type in ['2d', '3d']:
-        type_path = os.path.join(app.config['UPLOAD_FOLDER'], asset_type)
-        if os.path.exists(type_path):
-            files = os.listdir(type_path)
-            for file in files:
-                uploaded_files.append({
-                    'filename': file,
-                    'type': asset_type,
-                    'url': f"/static/assets/uploads/{asset_type}/{file}",
-                    'size': os.path.getsize(os.path.join(type_path, file))
-                })
+    # Page through the manifest instead of scanning the upload folders
+    filter_type = request.args.get('type', '')
+    filter_car_id = request.args.get('car_id', '')
+    page = max(request.args.get('page', 1, type=int), 1)
+    
+    query = {}
+    if filter_type in ASSET_TYPES:
+        query['type'] = filter_type
+    if filter_car_id:
+        query['car_id'] = filter_car_id
+    
+    total_files = mongo.db.uploaded_assets.count_documents(query)
+    uploaded_files = list(mongo.db.uploaded_assets.find(query)
+                          .sort('uploaded_at', -1)
+                          .skip((page - 1) * ASSETS_PER_PAGE)
+                          .limit(ASSETS_PER_PAGE))
     
     return render_template('admin/upload.html', 
                          car_templates=car_templates,
-                         uploaded_files=uploaded_files)
+                         uploaded_files=uploaded_files,
+                         total_files=total_files,
+                         page=page,
+                         total_pages=max((total_files + ASSETS_PER_PAGE - 1) // ASSETS_PER_PAGE, 1),
+                         filter_type=filter_type,
+                         filter_car_id=filter_car_id,
+                         max_2d_mb=APP_CONFIG['MAX_UPLOAD_MB_2D'],
+                         max_3d_mb=APP_CONFIG['MAX_UPLOAD_MB_3D'])
+
+# Stage fields the admin editor may change
+EDITABLE_STAGE_FIELDS = ('description', 'image_url', 'model_3d_url')
+# Every field a stored stage may have, with its type
+STAGE_FIELD_TYPES = {
+    'threshold': int,
+    'description': str,
+    'image_url': str,
+    'model_3d_url': str,
+    'image_variants': dict,
+    'model_3d_meta': dict,
+    'model_3d_variants': dict,
+}
+
+def stage_error(stage):
+    """Why an imported stage can't be stored, or None if it can"""
+    if not isinstance(stage, dict):
+        return 'Each stage must be an object'
+    for field, value in stage.items():
+        if field not in STAGE_FIELD_TYPES:
+            return f'Unknown stage field: {field}'
+        # bool is an int subclass, but not a threshold
+        if not isinstance(value, STAGE_FIELD_TYPES[field]) or isinstance(value, bool):
+            return f'Stage field {field} has the wrong type'
+    if 'threshold' not in stage or not 0 <= stage['threshold'] <= 100:
+        return 'Each stage needs a whole-number threshold between 0 and 100'
+    return None
+
+def build_stage_update(stage_changes):
+    """Turn [{'threshold': 25, 'updates': {...}}, ...] into one $set plus arrayFilters"""
+    fields = {}
+    removed = {}
+    array_filters = []
+    
+    # Stages pointed at an already processed image take its variants from the manifest
+    image_urls = [
+        (change.get('updates') or {}).get('image_url') for change in stage_changes
+        if (change.get('updates') or {}).get('image_url')
+    ]
+    known_variants = {}
+    if image_urls:
+        for asset in mongo.db.uploaded_assets.find(
+            {'type': '2d', 'url': {'$in': image_urls}, 'variants': {'$exists': True}},
+            {'url': 1, 'variants': 1}
+        ):
+            known_variants[asset['url']] = asset['variants']
+    
+    for index, change in enumerate(stage_changes):
+        updates = change.get('updates') or {}
+        if not updates:
+            continue
+        # Every identifier must be used, so only stages with changes get one
+        identifier = f's{index}'
+        for field, value in updates.items():
+            if field not in EDITABLE_STAGE_FIELDS:
+                raise ValueError(f'Stage field cannot be edited: {field}')
+            fields[f'stages.$[{identifier}].{field}'] = value
+        if 'image_url' in updates:
+            # Variants of the old image would keep showing it, even after the image is removed
+            if known_variants.get(updates['image_url']):
+                fields[f'stages.$[{identifier}].image_variants'] = known_variants[updates['image_url']]
+            else:
+                removed[f'stages.$[{identifier}].image_variants'] = ''
+        if 'model_3d_url' in updates:
+            # Analysis and LODs described the old model
+            removed[f'stages.$[{identifier}].model_3d_meta'] = ''
+            removed[f'stages.$[{identifier}].model_3d_variants'] = ''
+        array_filters.append({f'{identifier}.threshold': int(change['threshold'])})
+    
+    update = {'$set': fields}
+    if removed:
+        update['$unset'] = removed
+    return update, array_filters
 
 @app.route('/api/admin/update_car_stage', methods=['POST'])
 def admin_update_car_stage():
@@ -506,56 +2836,489 @@ def admin_update_car_stage():
     updates = data.get('updates', {})
     
     try:
-        # Update the specific stage
-        for field, value in updates.items():
+        # Update every field of the stage in one round trip
+        update, array_filters = build_stage_update([{'threshold': stage_threshold, 'updates': updates}])
+        if array_filters:
             mongo.db.car_templates.update_one(
-                {
-                    '_id': ObjectId(car_id),
-                    'stages.threshold': stage_threshold
-                },
-                {
-                    '$set': {f'stages.$.{field}': value}
-                }
+                {'_id': ObjectId(car_id)},
+                update,
+                array_filters=array_filters
             )
+            template_cache.invalidate()
         
         return jsonify({'success': True, 'message': 'Stage updated successfully'})
     
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)})
 
-# ================== 3D CAR VIEWER API ==================
+@app.route('/api/admin/update_car_stages', methods=['POST'])
+def admin_update_car_stages():
+    """Apply changes to many stages, and optionally many templates, in one request.
 
-@app.route('/api/car_3d/<model_id>')
-def get_car_3d_model(model_id):
-    """Get 3D model data for a specific car and progress"""
-    progress = float(request.args.get('progress', 0))
+    Accepts ``{'car_id': ..., 'stages': [{'threshold': 25, 'updates': {...}}]}``
+    or ``{'templates': [{'car_id': ..., 'stages': [...]}, ...]}``. Each
+    template gets a single update, so it is never left half-applied.
+    """
+    if not is_admin():
+        return jsonify({'success': False, 'error': 'Unauthorized'})
     
-    car_template = mongo.db.car_templates.find_one({'model_id': model_id})
-    if not car_template:
-        return jsonify({'error': 'Car template not found'}), 404
+    data = request.get_json()
+    templates = data.get('templates') or [{'car_id': data.get('car_id'), 'stages': data.get('stages', [])}]
+    
+    try:
+        operations = []
+        for template in templates:
+            update, array_filters = build_stage_update(template.get('stages', []))
+            if array_filters:
+                operations.append(UpdateOne(
+                    {'_id': ObjectId(template['car_id'])},
+                    update,
+                    array_filters=array_filters
+                ))
+        
+        if not operations:
+            return jsonify({'success': True, 'updated': 0, 'message': 'Nothing to update'})
+        
+        result = mongo.db.car_templates.bulk_write(operations, ordered=False)
+        template_cache.invalidate()
+        
+        return jsonify({
+            'success': True,
+            'updated': result.modified_count,
+            'message': f'Updated {result.modified_count} car template(s)'
+        })
+    
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)})
+
+@app.route('/api/admin/car_templates/export')
+def admin_export_car_templates():
+    """Download every car template as JSON, ready for import elsewhere"""
+    if not is_admin():
+        return jsonify({'success': False, 'error': 'Unauthorized'})
+    
+    templates = []
+    for template in mongo.db.car_templates.find({}, {'_id': 0}):
+        if isinstance(template.get('created_at'), datetime):
+            template['created_at'] = template['created_at'].isoformat()
+        templates.append(template)
+    
+    response = jsonify({'templates': templates})
+    response.headers['Content-Disposition'] = 'attachment; filename=car_templates.json'
+    return response
+
+@app.route('/api/admin/car_templates/import', methods=['POST'])
+def admin_import_car_templates():
+    """Create or replace car templates in bulk.
+
+    ``mode`` is ``upsert`` (default: replace templates with the same
+    model_id) or ``insert`` (only add templates whose model_id is new).
+    """
+    if not is_admin():
+        return jsonify({'success': False, 'error': 'Unauthorized'})
+    
+    data = request.get_json()
+    mode = data.get('mode', 'upsert')
+    templates = data.get('templates', [])
+    
+    for template in templates:
+        if not template.get('model_id') or not template.get('name') or not isinstance(template.get('stages'), list):
+            return jsonify({'success': False, 'error': 'Each template needs model_id, name and stages'})
+        # A bad threshold would break sorting in every worker's template cache
+        for stage in template['stages']:
+            error = stage_error(stage)
+            if error:
+                return jsonify({'success': False, 'error': f"{template['model_id']}: {error}"})
+        template.pop('_id', None)
+        if isinstance(template.get('created_at'), str):
+            template['created_at'] = datetime.fromisoformat(template['created_at'])
+        template.setdefault('created_at', datetime.utcnow())
+        template.setdefault('created_by', session.get('admin_user'))
     
-    # Find the appropriate stage based on progress
-    current_stage = None
-    for stage in car_template['stages']:
-        if progress >= stage['threshold']:
-            current_stage = stage
+    if not templates:
+        return jsonify({'success': False, 'error': 'No templates to import'})
+    
+    try:
+        if mode == 'insert':
+            try:
+                created = len(mongo.db.car_templates.insert_many(templates, ordered=False).inserted_ids)
+            except BulkWriteError as e:
+                # Duplicate model_ids are skipped, everything else still goes in
+                created = e.details['nInserted']
+            replaced = 0
         else:
-            break
+            result = mongo.db.car_templates.bulk_write([
+                ReplaceOne({'model_id': template['model_id']}, template, upsert=True)
+                for template in templates
+            ], ordered=False)
+            created = result.upserted_count
+            replaced = result.matched_count
+        
+        template_cache.invalidate()
+        if created:
+            dashboard_stats.increment(car_templates=created)
+        
+        return jsonify({
+            'success': True,
+            'created': created,
+            'replaced': replaced,
+            'skipped': len(templates) - created - replaced,
+            'message': f'Imported {created + replaced} car template(s)'
+        })
     
-    if not current_stage:
-        current_stage = car_template['stages'][0]
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)})
+
+@app.route('/api/admin/live_sessions')
+def admin_live_sessions():
+    """Users who are focusing right now"""
+    if not is_admin():
+        return jsonify({'success': False, 'error': 'Unauthorized'})
     
+    limit = min(max(request.args.get('limit', 100, type=int), 1), 500)
+    sessions = live_sessions.focusing_users(limit)
     return jsonify({
+        'success': True,
+        'count': live_sessions.count_focusing(),
+        'sessions': [{
+            'user_id': live['_id'],
+            'car_id': live.get('car_id'),
+            'task_description': live.get('task_description'),
+            'mode': live.get('mode'),
+            'duration_minutes': live.get('duration_minutes'),
+            'elapsed_minutes': live.get('elapsed_minutes'),
+            'started_at': live['started_at'].isoformat(),
+            'last_heartbeat': live['last_heartbeat'].isoformat()
+        } for live in sessions]
+    })
+
+# ================== ANALYTICS EXPORT ==================
+
+EXPORT_BATCH_SIZE = 1000
+MAX_EXPORT_BATCH_SIZE = 10000
+# collection -> (projection, fields that mark a document as new or changed)
+EXPORT_COLLECTIONS = {
+    'users': ({'password': 0}, ('created_at',)),
+    'user_cars': (None, ('created_at', 'last_session')),
+    'car_templates': (None, ('created_at',)),
+    'focus_sessions': (None, ('completed_at',)),
+}
+
+def export_value(value):
+    """json.dumps fallback: ObjectIds as strings, datetimes as ISO 8601"""
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f'Cannot export {type(value).__name__}')
+
+def export_filter(collection, since=None):
+    """Documents created or changed at or after the ``since`` watermark"""
+    if since is None:
+        return {}
+    clauses = [{field: {'$gte': since}} for field in EXPORT_COLLECTIONS[collection][1]]
+    return clauses[0] if len(clauses) == 1 else {'$or': clauses}
+
+def export_ndjson(collection, since=None, batch_size=EXPORT_BATCH_SIZE):
+    """Yield one JSON line per document.
+
+    The cursor fetches ``batch_size`` documents per round trip and nothing
+    is collected, so memory stays flat however large the collection is.
+    Reads go to a secondary when there is one to keep load off the primary.
+    """
+    projection = EXPORT_COLLECTIONS[collection][0]
+    source = mongo.db.get_collection(collection, read_preference=ReadPreference.SECONDARY_PREFERRED)
+    cursor = source.find(export_filter(collection, since), projection, batch_size=batch_size)
+    try:
+        for document in cursor:
+            yield json.dumps(document, default=export_value, separators=(',', ':')) + '\n'
+    finally:
+        # Runs when a client disconnects mid-download too
+        cursor.close()
+
+@app.route('/api/admin/export/<collection>')
+def admin_export(collection):
+    """Stream a collection as NDJSON; pass the X-Export-Watermark header back as ?since= next time"""
+    if not is_admin():
+        return jsonify({'success': False, 'error': 'Unauthorized'})
+    
+    if collection not in EXPORT_COLLECTIONS:
+        return jsonify({'success': False, 'error': 'Unknown collection'}), 404
+    
+    since = None
+    if request.args.get('since'):
+        try:
+            since = datetime.fromisoformat(request.args['since'])
+        except ValueError:
+            return jsonify({'success': False, 'error': 'since must be an ISO 8601 datetime'}), 400
+    batch_size = min(max(request.args.get('batch_size', EXPORT_BATCH_SIZE, type=int), 1), MAX_EXPORT_BATCH_SIZE)
+    
+    # Taken before reading, so changes made during the export are picked up next time
+    watermark = datetime.utcnow()
+    response = Response(
+        stream_with_context(export_ndjson(collection, since, batch_size)),
+        mimetype='application/x-ndjson'
+    )
+    response.headers['Content-Disposition'] = f'attachment; filename={collection}.ndjson'
+    response.headers['X-Export-Watermark'] = watermark.isoformat()
+    return response
+
+@app.cli.command('export-ndjson')
+@click.argument('collection', type=click.Choice(sorted(EXPORT_COLLECTIONS)))
+@click.option('--since', type=click.DateTime(['%Y-%m-%d', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%dT%H:%M:%S.%f']),
+              help='Only documents created or changed at or after this UTC time.')
+@click.option('--batch-size', default=EXPORT_BATCH_SIZE, show_default=True, help='Documents per cursor batch.')
+@click.option('--output', type=click.File('w'), default='-', help='File to write (default: stdout).')
+def export_ndjson_command(collection, since, batch_size, output):
+    """Export a collection as NDJSON for analytics."""
+    watermark = datetime.utcnow()
+    exported = 0
+    for line in export_ndjson(collection, since, batch_size):
+        output.write(line)
+        exported += 1
+    click.echo(f'Exported {exported} {collection} documents; next run: --since {watermark.isoformat()}', err=True)
+
+# ================== ASSET SERVING ==================
+
+mimetypes.add_type('model/gltf-binary', '.glb')
+mimetypes.add_type('model/gltf+json', '.gltf')
+mimetypes.add_type('model/obj', '.obj')
+mimetypes.add_type('image/webp', '.webp')
+
+# Content-addressed names never change meaning, so they can be cached forever
+CONTENT_HASHED_NAME = re.compile(r'^([0-9a-f]{64}(?:_[a-z0-9]+)?)\.[a-z0-9]+$')
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+MUTABLE_MAX_AGE = 60 * 60
+
+@app.route('/assets/uploads/<asset_type>/<filename>')
+def serve_asset(asset_type, filename):
+    """Serve uploaded assets with strong ETags, Range support and gzip variants"""
+    if asset_type not in ASSET_TYPES + (DERIVED_FOLDER,) or filename.endswith('.gz'):
+        return jsonify({'error': 'Asset not found'}), 404
+    
+    directory = os.path.join(app.root_path, app.config['UPLOAD_FOLDER'], asset_type)
+    content_hash = CONTENT_HASHED_NAME.match(filename)
+    if content_hash:
+        etag, max_age = content_hash.group(1), IMMUTABLE_MAX_AGE
+    else:
+        etag, max_age = True, MUTABLE_MAX_AGE
+    
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    compressible = filename.rsplit('.', 1)[-1].lower() in GZIP_EXTENSIONS
+    use_gzip = (compressible
+                and 'gzip' in request.accept_encodings
+                and os.path.isfile(os.path.join(directory, filename + '.gz')))
+    
+    if use_gzip:
+        response = send_from_directory(directory, filename + '.gz', mimetype=mimetype,
+                                       etag=f'{etag}-gzip' if content_hash else True,
+                                       max_age=max_age, conditional=True)
+        response.headers['Content-Encoding'] = 'gzip'
+    else:
+        response = send_from_directory(directory, filename, mimetype=mimetype,
+                                       etag=etag, max_age=max_age, conditional=True)
+    
+    response.cache_control.public = True
+    if content_hash:
+        response.cache_control.immutable = True
+    if compressible:
+        response.vary.add('Accept-Encoding')
+    return response
+
+# ================== 3D CAR VIEWER API ==================
+
+# Most stage lookups a single batch request will resolve
+MAX_BATCH_CARS = 50
+
+def stage_payload(model_id, progress):
+    """Viewer data for the stage a car is at, or None if the template is unknown"""
+    current_stage = template_cache.stage_for_progress(model_id, progress)
+    if not current_stage:
+        return None
+    
+    return {
         'model_3d_url': current_stage.get('model_3d_url', ''),
         'image_url': current_stage.get('image_url', ''),
+        'image_variants': current_stage.get('image_variants', {}),
+        'model_3d_meta': current_stage.get('model_3d_meta'),
+        'model_3d_variants': current_stage.get('model_3d_variants', {}),
         'description': current_stage.get('description', ''),
         'progress': progress,
         'stage_threshold': current_stage.get('threshold', 0)
-    })
+    }
+
+def template_versioned_response(payload, *key_parts):
+    """JSON response with an ETag tied to the template version, answering 304 when it still matches"""
+    key = ':'.join(str(part) for part in (template_cache.version,) + key_parts)
+    response = jsonify(payload)
+    response.set_etag(hashlib.sha1(key.encode()).hexdigest())
+    # Always revalidate so template edits show up on the next load
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+@app.route('/api/car_3d/<model_id>')
+def get_car_3d_model(model_id):
+    """Get 3D model data for a specific car and progress"""
+    progress = float(request.args.get('progress', 0))
+    
+    payload = stage_payload(model_id, progress)
+    if not payload:
+        return jsonify({'error': 'Car template not found'}), 404
+    
+    return template_versioned_response(payload, model_id, progress)
+
+@app.route('/api/car_3d/batch')
+def get_car_3d_models():
+    """Get 3D model data for several cars at once.
+
+    Takes ``cars=<model_id>:<progress>,<model_id>:<progress>,...`` and
+    returns one result per pair, in order.
+    """
+    pairs = []
+    for item in request.args.get('cars', '').split(','):
+        if not item:
+            continue
+        model_id, _, progress = item.rpartition(':')
+        try:
+            pairs.append((model_id, float(progress)))
+        except ValueError:
+            return jsonify({'error': f'Invalid car entry: {item}'}), 400
+    
+    if not pairs:
+        return jsonify({'error': 'No cars requested'}), 400
+    if len(pairs) > MAX_BATCH_CARS:
+        return jsonify({'error': f'At most {MAX_BATCH_CARS} cars per request'}), 400
+    
+    # All lookups share the template cache, so this is at most one query
+    results = []
+    for model_id, progress in pairs:
+        payload = stage_payload(model_id, progress)
+        if payload:
+            results.append({'model_id': model_id, **payload})
+        else:
+            results.append({'model_id': model_id, 'error': 'Car template not found'})
+    
+    return template_versioned_response({'results': results}, *pairs)
+
+# ================== APP FACTORY ==================
+
+# Changes whenever the index set does, so a deploy with new indexes bootstraps again
+BOOTSTRAP_VERSION = hashlib.sha1(repr(INDEXES).encode()).hexdigest()[:12]
+# How long a crashed worker's bootstrap claim blocks the others
+BOOTSTRAP_CLAIM_TIMEOUT = timedelta(minutes=5)
+# Seconds a worker waits before checking again on a bootstrap that isn't done yet
+BOOTSTRAP_RETRY_INTERVAL = 30
+
+_bootstrapped_pid = None
+_bootstrap_checked_at = 0.0
+
+def mongo_client_options():
+    """MongoClient keyword arguments built from APP_CONFIG"""
+    # Request threads plus the flusher, reconciler and derivative callbacks
+    max_pool_size = APP_CONFIG['MONGO_MAX_POOL_SIZE'] or APP_CONFIG['WORKER_THREADS'] + 4
+    return {
+        'maxPoolSize': max_pool_size,
+        'minPoolSize': min(APP_CONFIG['MONGO_MIN_POOL_SIZE'], max_pool_size),
+        'connectTimeoutMS': APP_CONFIG['MONGO_CONNECT_TIMEOUT_MS'],
+        'serverSelectionTimeoutMS': APP_CONFIG['MONGO_SERVER_SELECTION_TIMEOUT_MS'],
+        'socketTimeoutMS': APP_CONFIG['MONGO_SOCKET_TIMEOUT_MS'] or None,
+        'waitQueueTimeoutMS': APP_CONFIG['MONGO_WAIT_QUEUE_TIMEOUT_MS'] or None,
+        'readPreference': APP_CONFIG['MONGO_READ_PREFERENCE'],
+        # Don't start monitor threads before gunicorn forks the workers
+        'connect': False,
+        'event_listeners': [request_metrics],
+    }
+
+def bootstrap_database():
+    """Ensure indexes and seed templates once per deployment, whichever worker gets there first.
+
+    Workers race to claim an ``app_meta`` document for the current
+    BOOTSTRAP_VERSION. The losers return immediately. A claim that is never
+    completed expires after BOOTSTRAP_CLAIM_TIMEOUT so another worker can retry.
+    Returns True once this deployment is bootstrapped, by this worker or another.
+    """
+    key = f'bootstrap:{BOOTSTRAP_VERSION}'
+    now = datetime.utcnow()
+    try:
+        mongo.db.app_meta.update_one(
+            {
+                '_id': key,
+                'completed_at': {'$exists': False},
+                'claimed_at': {'$lt': now - BOOTSTRAP_CLAIM_TIMEOUT}
+            },
+            {'$set': {'claimed_at': now, 'claimed_by': os.getpid()}},
+            upsert=True
+        )
+    except DuplicateKeyError:
+        # Already done, or another worker is on it
+        return mongo.db.app_meta.find_one({'_id': key, 'completed_at': {'$exists': True}}, {'_id': 1}) is not None
+    
+    init_indexes()
+    init_car_templates()
+    mongo.db.app_meta.update_one({'_id': key}, {'$set': {'completed_at': datetime.utcnow()}})
+    return True
+
+@app.before_request
+def ensure_bootstrapped():
+    global _bootstrapped_pid, _bootstrap_checked_at
+    if _bootstrapped_pid == os.getpid():
+        return
+    # Until it's done (here or elsewhere), retry now and then rather than on every request
+    now = time.monotonic()
+    if now - _bootstrap_checked_at < BOOTSTRAP_RETRY_INTERVAL:
+        return
+    _bootstrap_checked_at = now
+    try:
+        if bootstrap_database():
+            _bootstrapped_pid = os.getpid()
+    except Exception:
+        app.logger.exception('Database bootstrap failed; retrying in %ss', BOOTSTRAP_RETRY_INTERVAL)
+
+def create_app(config=None):
+    """Configure the app and its MongoDB client, then return it.
+
+    ``config`` overrides APP_CONFIG entries, and any other key is applied
+    to the Flask config. The client is created with connect=False, so
+    calling this in a gunicorn master (``gunicorn "app:create_app()"``) is
+    fork-safe. Each worker connects, and bootstraps the database if no
+    other worker has, on its first request.
+    """
+    for key, value in (config or {}).items():
+        if key in APP_CONFIG:
+            APP_CONFIG[key] = value
+        else:
+            app.config[key] = value
+    
+    # Background helpers were built with the import-time settings
+    template_cache.ttl = APP_CONFIG['TEMPLATE_CACHE_TTL']
+    live_sessions.flush_interval = APP_CONFIG['LIVE_FLUSH_INTERVAL']
+    live_sessions.max_pending = APP_CONFIG['LIVE_MAX_PENDING']
+    live_sessions.expiry_seconds = APP_CONFIG['LIVE_SESSION_EXPIRY']
+    dashboard_stats.reconcile_interval = APP_CONFIG['STATS_RECONCILE_INTERVAL']
+    dashboard_stats.flush_interval = APP_CONFIG['STATS_FLUSH_INTERVAL']
+    rollup_buffer.flush_interval = APP_CONFIG['ROLLUP_FLUSH_INTERVAL']
+    rollup_buffer.max_pending = APP_CONFIG['ROLLUP_MAX_PENDING']
+    image_derivatives.max_workers = APP_CONFIG['DERIVATIVE_WORKERS']
+    password_hasher.method = APP_CONFIG['PASSWORD_HASH_METHOD']
+    password_hasher.workers = APP_CONFIG['HASH_WORKERS']
+    password_hasher.queue_depth = APP_CONFIG['HASH_QUEUE_DEPTH']
+    password_hasher.timeout = APP_CONFIG['HASH_TIMEOUT']
+    password_hasher.failed_login_ttl = APP_CONFIG['FAILED_LOGIN_TTL']
+    password_hasher.max_failed_logins = APP_CONFIG['MAX_FAILED_LOGINS']
+    server_sessions.lifetime = APP_CONFIG['SESSION_TIMEOUT']
+    server_sessions.cache_size = APP_CONFIG['SESSION_CACHE_SIZE']
+    server_sessions.cache_ttl = APP_CONFIG['SESSION_CACHE_TTL']
+    
+    if mongo.cx is not None:
+        mongo.cx.close()
+    mongo.init_app(app, **mongo_client_options())
+    return app
+
+create_app()
 
 if __name__ == '__main__':
     with app.app_context():
-        init_car_templates()
+        bootstrap_database()
     app.run(
         debug=APP_CONFIG['FLASK_DEBUG'],
         host=APP_CONFIG['FLASK_HOST'],
@@ -0,0 +1,297 @@
+"""Load-test and benchmark harness for Garage Focus.
+
+Drives realistic user and admin flows through the Flask test client and
+reports throughput, p50/p95/p99 latency and MongoDB commands per request
+for every route. Results are written as JSON so runs from different
+commits can be compared.
+
+    python benchmark.py --users 50 --concurrency 8
+    python benchmark.py --mongomock --users 20 --output before.json
+    python benchmark.py --compare before.json --output after.json
+
+By default it runs against a local MongoDB database whose name must
+contain "bench"; that database is dropped before each run. ``--mongomock``
+uses an in-memory stand-in instead (``pip install mongomock``); routes
+that use aggregation features mongomock lacks, such as the garage page's
+``$lookup``, are reported as errors in that mode.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from pymongo import monitoring
+
+DEFAULT_MONGO_URI = 'mongodb://localhost:27017/garage_focus_bench'
+
+# Commands issued by the current thread, reset before every request
+_commands = threading.local()
+
+def _count_command():
+    _commands.count = getattr(_commands, 'count', 0) + 1
+
+class CommandCounter(monitoring.CommandListener):
+    """Counts MongoDB commands per thread; pymongo reports them on the calling thread"""
+
+    def started(self, event):
+        _count_command()
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+# Collection methods that each cost one round trip on a real server
+MONGOMOCK_COMMANDS = (
+    'find_one', 'insert_one', 'insert_many', 'update_one', 'update_many',
+    'replace_one', 'delete_one', 'delete_many', 'find_one_and_update',
+    'count_documents', 'aggregate', 'bulk_write', 'create_index', 'find',
+)
+
+def patch_mongomock_counting(mongomock):
+    """mongomock has no command monitoring, so count the collection calls instead"""
+    for name in MONGOMOCK_COMMANDS:
+        original = getattr(mongomock.collection.Collection, name)
+
+        def counted(self, *args, __original=original, **kwargs):
+            # Methods like find_one call find internally; only the outermost call is a round trip
+            depth = getattr(_commands, 'depth', 0)
+            if not depth:
+                _count_command()
+            _commands.depth = depth + 1
+            try:
+                return __original(self, *args, **kwargs)
+            finally:
+                _commands.depth = depth
+
+        setattr(mongomock.collection.Collection, name, counted)
+
+class Recorder:
+    """Collects latency and command counts per route"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    def call(self, route, send):
+        _commands.count = 0
+        started = time.perf_counter()
+        try:
+            response = send()
+        except Exception as e:
+            # e.g. an aggregation stage mongomock doesn't implement
+            with self._lock:
+                if not self.errors[route]:
+                    print(f'{route} raised {type(e).__name__}: {e}', file=sys.stderr)
+                self.errors[route] += 1
+            return None
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self.samples[route].append((elapsed, _commands.count))
+            if response.status_code >= 400:
+                self.errors[route] += 1
+        return response
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+def summarize(recorder, wall_seconds):
+    routes = {}
+    for route, samples in sorted(recorder.samples.items()):
+        latencies = sorted(elapsed for elapsed, _ in samples)
+        commands = [count for _, count in samples]
+        routes[route] = {
+            'count': len(samples),
+            'errors': recorder.errors[route],
+            'throughput_rps': round(len(samples) / wall_seconds, 2),
+            'mean_ms': round(sum(latencies) / len(latencies) * 1000, 3),
+            'p50_ms': round(percentile(latencies, 0.50) * 1000, 3),
+            'p95_ms': round(percentile(latencies, 0.95) * 1000, 3),
+            'p99_ms': round(percentile(latencies, 0.99) * 1000, 3),
+            'mongo_commands_per_request': round(sum(commands) / len(commands), 2),
+        }
+    total = sum(route['count'] for route in routes.values())
+    return routes, {
+        'requests': total,
+        'errors': sum(recorder.errors.values()),
+        'wall_seconds': round(wall_seconds, 3),
+        'throughput_rps': round(total / wall_seconds, 2),
+    }
+
+def backdate_session(client, minutes):
+    """Make the active session look as if it started ``minutes`` ago"""
+    with client.session_transaction() as flask_session:
+        active = dict(flask_session['active_session'])
+        active['start_time'] = (datetime.utcnow() - timedelta(minutes=minutes)).isoformat()
+        flask_session['active_session'] = active
+
+def user_flow(app, recorder, index, options):
+    """One user: register, log in, pick a car, focus, and look at the garage"""
+    client = app.test_client()
+    username = f'bench_user_{index}'
+    password = 'bench-password'
+    car_model = ('mustang_1969', 'corvette_1965')[index % 2]
+
+    recorder.call('POST /register', lambda: client.post('/register', data={
+        'username': username, 'password': password, 'confirm_password': password
+    }))
+    client.get('/logout')
+    recorder.call('POST /login', lambda: client.post('/login', data={
+        'username': username, 'password': password
+    }))
+    recorder.call('GET /junkyard', lambda: client.get('/junkyard'))
+    recorder.call('POST /api/select_car', lambda: client.post('/api/select_car', json={'car_model': car_model}))
+
+    for _ in range(options.sessions):
+        recorder.call('POST /api/start_session', lambda: client.post('/api/start_session', json={
+            'duration': 25, 'task': 'Benchmark', 'mode': 'focus'
+        }))
+        backdate_session(client, 26)
+        for beat in range(options.heartbeats):
+            recorder.call('POST /api/heartbeat', lambda: client.post('/api/heartbeat', json={
+                'elapsed_minutes': beat + 1, 'mode': 'focus'
+            }))
+        response = recorder.call('POST /api/complete_session', lambda: client.post('/api/complete_session', json={
+            'minutes_focused': 25, 'success': True, 'mode': 'focus'
+        }))
+        progress = ((response and response.get_json()) or {}).get('progress', 0)
+        # The garage updates in place after a session, as the page does after a sync
+        recorder.call('GET /api/garage/panels', lambda: client.get('/api/garage/panels'))
+        recorder.call('GET /api/car_3d/<model_id>', lambda: client.get(f'/api/car_3d/{car_model}?progress={progress}'))
+    recorder.call('GET /', lambda: client.get('/'))
+
+def admin_flow(app, recorder, options):
+    client = app.test_client()
+    client.post('/admin/login', data={
+        'username': options.admin_username, 'password': options.admin_password
+    })
+    for _ in range(options.admin_views):
+        recorder.call('GET /admin/dashboard', lambda: client.get('/admin/dashboard'))
+        recorder.call('GET /admin/upload', lambda: client.get('/admin/upload'))
+        recorder.call('GET /admin/cars', lambda: client.get('/admin/cars'))
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(results, baseline_path, threshold):
+    """Return (route, metric, before, after) for metrics that got worse by more than threshold"""
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    regressions = []
+    for route, after in results['routes'].items():
+        before = baseline.get('routes', {}).get(route)
+        if not before:
+            continue
+        for metric in ('p95_ms', 'mongo_commands_per_request'):
+            if before[metric] and after[metric] > before[metric] * (1 + threshold):
+                regressions.append((route, metric, before[metric], after[metric]))
+    return regressions
+
+def setup_app(options):
+    """Import the app against the benchmark database and bootstrap it"""
+    if options.mongomock:
+        try:
+            import mongomock
+        except ImportError:
+            sys.exit('--mongomock needs the mongomock package: pip install mongomock')
+        patch_mongomock_counting(mongomock)
+    else:
+        database = options.mongo_uri.rsplit('/', 1)[-1].split('?', 1)[0]
+        if 'bench' not in database:
+            sys.exit(f'Refusing to benchmark against "{database}": the database name must contain "bench"')
+        monitoring.register(CommandCounter())
+
+    os.environ['MONGO_URI'] = options.mongo_uri
+    import app as garage
+
+    application = garage.create_app({'TESTING': True, 'MONGO_URI': options.mongo_uri})
+    if options.mongomock:
+        garage.mongo.cx = mongomock.MongoClient()
+        garage.mongo.db = garage.mongo.cx['garage_focus_bench']
+    else:
+        garage.mongo.cx.drop_database(garage.mongo.db.name)
+
+    with application.app_context():
+        garage.bootstrap_database()
+    return garage, application
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark Garage Focus routes')
+    parser.add_argument('--users', type=int, default=20, help='virtual users to run through the flow')
+    parser.add_argument('--concurrency', type=int, default=4, help='users running at the same time')
+    parser.add_argument('--sessions', type=int, default=2, help='focus sessions per user')
+    parser.add_argument('--heartbeats', type=int, default=3, help='heartbeats per session')
+    parser.add_argument('--admin-views', type=int, default=10, help='admin page rounds')
+    parser.add_argument('--mongo-uri', default=os.environ.get('BENCH_MONGO_URI', DEFAULT_MONGO_URI))
+    parser.add_argument('--mongomock', action='store_true', help='use an in-memory MongoDB stand-in')
+    parser.add_argument('--admin-username', default=os.environ.get('ADMIN_USERNAME', 'admin'))
+    parser.add_argument('--admin-password', default=os.environ.get('ADMIN_PASSWORD', 'garage123'))
+    parser.add_argument('--output', default='benchmark-results.json', help='where to write the JSON results')
+    parser.add_argument('--compare', help='earlier results file to check for regressions')
+    parser.add_argument('--threshold', type=float, default=0.2, help='allowed slowdown before a regression is reported')
+    options = parser.parse_args()
+
+    garage, application = setup_app(options)
+    recorder = Recorder()
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=options.concurrency) as pool:
+        futures = [pool.submit(user_flow, application, recorder, index, options) for index in range(options.users)]
+        for future in futures:
+            future.result()
+    admin_flow(application, recorder, options)
+    wall_seconds = time.perf_counter() - started
+
+    routes, totals = summarize(recorder, wall_seconds)
+    results = {
+        'meta': {
+            'revision': git_revision(),
+            'timestamp': datetime.utcnow().isoformat(),
+            'backend': 'mongomock' if options.mongomock else 'mongodb',
+            'users': options.users,
+            'concurrency': options.concurrency,
+            'sessions_per_user': options.sessions,
+            'heartbeats_per_session': options.heartbeats,
+            'python': platform.python_version(),
+        },
+        'totals': totals,
+        'routes': routes,
+    }
+    with open(options.output, 'w') as f:
+        json.dump(results, f, indent=2)
+
+    print(f"{'route':32} {'count':>6} {'rps':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'cmds':>6}")
+    for route, stats in routes.items():
+        print(f"{route:32} {stats['count']:>6} {stats['throughput_rps']:>8} {stats['p50_ms']:>9} "
+              f"{stats['p95_ms']:>9} {stats['p99_ms']:>9} {stats['mongo_commands_per_request']:>6}")
+    print(f"\n{totals['requests']} requests in {totals['wall_seconds']}s "
+          f"({totals['throughput_rps']} req/s, {totals['errors']} errors) -> {options.output}")
+
+    if options.compare:
+        regressions = compare(results, options.compare, options.threshold)
+        for route, metric, before, after in regressions:
+            print(f'REGRESSION {route} {metric}: {before} -> {after}')
+        if regressions:
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -196,6 +196,40 @@ class Car3DViewer {
         this.isLoading = false;
     }
     
+    // Replace the shown model with a more detailed one once it has loaded,
+    // keeping the current model on screen while the download runs
+    upgradeCarModel(modelUrl, progress = 0) {
+        const fileExt = modelUrl.split('.').pop().toLowerCase();
+        if (fileExt !== 'glb' && fileExt !== 'gltf') {
+            return this.loadCarModel(modelUrl, progress);
+        }
+        
+        return new Promise((resolve) => {
+            const loader = new THREE.GLTFLoader();
+            loader.load(
+                modelUrl,
+                (gltf) => {
+                    if (this.isLoading) {
+                        resolve(false);
+                        return;
+                    }
+                    if (this.currentModel) {
+                        this.scene.remove(this.currentModel);
+                        this.disposeMaterial(this.currentModel);
+                    }
+                    this.currentModel = gltf.scene;
+                    this.processLoadedModel(progress);
+                    resolve(true);
+                },
+                undefined,
+                (error) => {
+                    console.warn('Keeping lower-detail model; upgrade failed:', error);
+                    resolve(false);
+                }
+            );
+        });
+    }
+    
     async loadGLTFModel(url, progress) {
         return new Promise((resolve, reject) => {
             const loader = new THREE.GLTFLoader();
@@ -390,7 +424,17 @@ class Car3DViewer {
         }, 5000);
     }
     
-    enableFallback() {
+    enableFallback(imageUrl = null) {
+        // Show the stage image when one exists
+        if (imageUrl) {
+            this.container.innerHTML = `
+                <div class="fallback-viewer w-full h-full flex items-center justify-center bg-garage-dark rounded-lg border border-gray-600">
+                    <img src="${imageUrl}" alt="Car stage" class="max-w-full max-h-full object-contain">
+                </div>
+            `;
+            return;
+        }
+        
         // Create fallback 2D display
         this.container.innerHTML = `
             <div class="fallback-viewer w-full h-full flex items-center justify-center bg-garage-dark rounded-lg border border-gray-600">